@@ -2,11 +2,41 @@ from qiskit import QuantumRegister, QuantumCircuit, ClassicalRegister
 import numpy as np
 import approxQArrayMultiplier as AQAM
 import ImpRepAddition as IOPB
+import approxRepeatedAddition as AOPB
 import QArrayMultiplier as QAM
 import RepeatedAddition as OPB
 import QFourierMultiplier as QFM
-from sharedFunctions import runIdeal, runNoisy, runLessNoisy
+from qiskit.quantum_info import Statevector
+from sharedFunctions import runNoisy, runLessNoisy, runBatch, exactSuccessProbability, \
+    noisySuccessProbability, defaultSession, noiseSweep, NoiseConfig, simplifyKnownStates, StageProfiler, \
+    SimulationSession
+from sweepRunner import expandGrid, runSweep
+from resultsStore import ResultsStore
+from productRegisterSimulator import ProductRegisterSimulator
 from math import ceil, log2
+import time
+import os
+import tempfile
+
+
+def noisyTests(qc, value, bits, timesToTest):
+    """
+    Prints the noisy and less noisy results of a circuit. Circuits small enough for the density matrix limit of the
+    default session print the exact probability of the answer once, larger ones are run timesToTest times.
+
+    :param qc: The pre-created quantum circuit to be run
+    :param value: The expected answer for the multiplication
+    :param bits: how many bits there will be in the output
+    :param timesToTest: The number of times to repeat a sampled circuit
+    :return: None
+    """
+    for label, noise, run in (("Noisy", "noisy", runNoisy), ("Less Noisy", "lessNoisy", runLessNoisy)):
+        print("-------" + label + "-------")
+        if qc.num_qubits <= defaultSession.densityMatrixQubits:
+            print("P(answer) :", noisySuccessProbability(qc, value, bits, noise))
+        else:
+            for i in range(timesToTest):
+                run(qc, value, bits)
 
 
 def OPBTest(maxNum, timesToTest):
@@ -171,12 +201,7 @@ def QAMTest(maxNum, timesToTest):
         # print("-------Ideal-------")
         # for i in range(timesToTest):
         #     runIdeal(qc, value, len(num) * 2)
-        print("-------Noisy-------")
-        for i in range(timesToTest):
-            runNoisy(qc, value, len(num) * 2)
-        print("-------Less Noisy-------")
-        for i in range(timesToTest):
-            runLessNoisy(qc, value, len(num) * 2)
+        noisyTests(qc, value, len(num) * 2, timesToTest)
         del qc
         print("---------", i+1)
     num = ""
@@ -192,12 +217,7 @@ def QAMTest(maxNum, timesToTest):
         # print("-------Ideal-------")
         # for i in range(timesToTest):
         #     runIdeal(qc, value, len(num) + 1)
-        print("-------Noisy-------")
-        for i in range(timesToTest):
-            runNoisy(qc, value, len(num) + 1)
-        print("-------Less Noisy-------")
-        for i in range(timesToTest):
-            runLessNoisy(qc, value, len(num) + 1)
+        noisyTests(qc, value, len(num) + 1, timesToTest)
         del qc
         print("---------", i+1)
     print("______________END_OF_QAM_______________")
@@ -221,16 +241,10 @@ def AQAMTest(maxNum, timesToTest):
         print("Creating a square AQAM Circuit of size ", num)
         qc = AQAM.createAQAMCircuit(num, num, limit)
         print("depth :", qc.decompose().decompose().decompose().depth())
-        # This one isn't 100% accurate when ideal so still run
+        # This one isn't 100% accurate when ideal so still run, once since the probability is exact
         print("-------Ideal-------")
-        for i in range(timesToTest):
-            runIdeal(qc, value, len(num) * 2)
-        print("-------Noisy-------")
-        for i in range(timesToTest):
-            runNoisy(qc, value, len(num) * 2)
-        print("-------Less Noisy-------")
-        for i in range(timesToTest):
-            runLessNoisy(qc, value, len(num) * 2)
+        print("P(answer) :", exactSuccessProbability(qc, value, len(num) * 2)[0])
+        noisyTests(qc, value, len(num) * 2, timesToTest)
         del qc
         print("---------", i)
     num = ""
@@ -243,21 +257,296 @@ def AQAMTest(maxNum, timesToTest):
         print("Creating an identity AQAM Circuit of size ", num)
         qc = AQAM.createAQAMCircuit(num, "1", limit)
         print("depth :", qc.decompose().decompose().decompose().depth())
-        # This one isn't 100% accurate when ideal so still run
+        # This one isn't 100% accurate when ideal so still run, once since the probability is exact
         print("-------Ideal-------")
-        for i in range(timesToTest):
-            runIdeal(qc, value, len(num)+1)
-        print("-------Noisy-------")
-        for i in range(timesToTest):
-            runNoisy(qc, value, len(num)+1)
-        print("-------Less Noisy-------")
-        for i in range(timesToTest):
-            runLessNoisy(qc, value, len(num) + 1)
+        print("P(answer) :", exactSuccessProbability(qc, value, len(num) + 1)[0])
+        noisyTests(qc, value, len(num) + 1, timesToTest)
         del qc
         print("---------", i)
     print("______________END_OF_AQAM_______________")
 
 
+def batchSweepTest(name, createCircuit, maxNum, timesToTest):
+    """
+    Runs both the square and identity circuits of one design up to the max input length, like the tests above, but
+    submits the whole sweep as one batch per noise level instead of one job per run.
+
+    :param name: The name of the design, used in the printed results
+    :param createCircuit: A function taking the multiplier and multiplicand bit strings and returning the circuit
+    :param maxNum: The highest size input to run the test up to
+    :param timesToTest: The number of times to repeat each generated circuit
+    :return: None
+    """
+    items = []
+    labels = []
+    for i in range(1, maxNum + 1):
+        num = "1" * i
+        items.append((createCircuit(num, num), int(num, 2) ** 2, len(num) * 2, timesToTest))
+        labels.append("square " + num)
+        items.append((createCircuit(num, "1"), int(num, 2), len(num) + 1, timesToTest))
+        labels.append("identity " + num)
+    for noise in ("noisy", "lessNoisy"):
+        print("-------{} {}-------".format(name, noise))
+        for label, successes in zip(labels, runBatch(items, noise)):
+            print(label, ": ", successes)
+    print("______________END_OF_{}_______________".format(name))
+
+
+def noiseCurveTest(maxNum, scales=(0.1, 0.3, 1, 3, 10, 30, 100)):
+    """
+    Prints the success probability of square QAM and AQAM circuits up to the max input length against the strength of
+    the less noisy gate noise, scaled from its default rates, to compare the approximation against the noise.
+
+    :param maxNum: The highest size input to run the test up to
+    :param scales: The factors the default rates are multiplied by
+    :return: None
+    """
+    configs = [NoiseConfig(0.00001 * scale, 0.0001 * scale) for scale in scales]
+    for i in range(1, maxNum + 1):
+        num = "1" * i
+        value = int(num, 2) ** 2
+        limit = ceil(log2(i * 2) + 2)
+        for name, qc in (("QAM", QAM.createQAMCircuit(num, num)), ("AQAM", AQAM.createAQAMCircuit(num, num, limit))):
+            print("-------{} square {}-------".format(name, num))
+            for scale, (config, probability) in zip(scales, noiseSweep(qc, value, len(num) * 2, configs)):
+                print("x{} : {:.4f}".format(scale, probability))
+    print("______________END_OF_NOISE_CURVE_______________")
+
+
+def idealSweepTest(maxNum=2, shots=256):
+    """
+    Runs an ideal sweep of every compared algorithm on square inputs up to the max input length and checks that every
+    task, including the QFM whose library gate Aer does not know, finishes with every shot measuring the answer. The
+    exact probability of the QFM is checked as well. Prints the results to the console
+
+    :param maxNum: The highest size input to run the test up to
+    :param shots: The number of shots of every task
+    :return: None
+    """
+    tasks = expandGrid(patterns=("square",), sizes=range(1, maxNum + 1), noises=("ideal",), seed=0)
+    for record in runSweep(tasks, processes=1, timeout=600, shots=shots):
+        assert record["status"] == "ok", record
+        if record["algorithm"] != "AQAM":
+            assert record["successes"] == [shots], record
+        print(record["algorithm"], record["multiplier"], "x", record["multiplicand"], ": ", record["successes"])
+    for i in range(1, maxNum + 1):
+        num = "1" * i
+        probability = exactSuccessProbability(QFM.createQFMCircuit(num, num), int(num, 2) ** 2, len(num) * 2)[0]
+        assert abs(probability - 1) < 1e-9, probability
+        print("QFM", num, "x", num, "P(answer) :", probability)
+    print("______________END_OF_IDEAL_SWEEP_______________")
+
+
+def wideCircuitTest(num="11111111", shots=64):
+    """
+    Runs QAM and QFM circuits wider than the 28 qubit target of AerSimulator ideally with matrix product states and
+    checks that runIdeal, exactSuccessProbability and the ideal runBatch all measure the answer. Prints the results to
+    the console
+
+    :param num: The binary string used as both the multiplier and the multiplicand
+    :param shots: The number of shots of the batch
+    :return: None
+    """
+    session = SimulationSession(allowMPS=True)
+    answer = int(num, 2) ** 2
+    bits = len(num) * 2
+    for name, qc in (("QAM", QAM.createQAMCircuit(num, num)), ("QFM", QFM.createQFMCircuit(num, num))):
+        assert qc.num_qubits > 28, qc.num_qubits
+        counts = session.runIdeal(qc, answer, bits).get_counts(0)
+        assert counts == {bin(answer)[2:].zfill(bits): 1024}, counts
+        probability = session.exactSuccessProbability(qc, answer, bits)[0]
+        assert abs(probability - 1) < 1e-9, probability
+        successes = session.runBatch([(qc, answer, bits, 1)], "ideal", shots=shots)
+        assert successes == [[shots]], successes
+        print(name, qc.num_qubits, "qubits P(answer) :", probability, "batch :", successes)
+    print("______________END_OF_WIDE_CIRCUITS_______________")
+
+
+def memoryRefusalTest(num="1111111111"):
+    """
+    Checks that a 40 qubit QAM is refused with a MemoryError by every simulation, ideal and noisy, before it is
+    transpiled, and that the approximate extended stabilizer method is only picked when opted into and never for exact
+    probabilities. Prints the time each refusal took to the console
+
+    :param num: The binary string used as both the multiplier and the multiplicand
+    :return: None
+    """
+    session = SimulationSession()
+    qc = QAM.createQAMCircuit(num, num)
+    answer = int(num, 2) ** 2
+    bits = len(num) * 2
+    assert qc.num_qubits == 40, qc.num_qubits
+    runs = (("runIdeal", lambda: session.runIdeal(qc, answer, bits)),
+            ("exactSuccessProbability", lambda: session.exactSuccessProbability(qc, answer, bits)),
+            ("runBatch ideal", lambda: session.runBatch([(qc, answer, bits, 1)], "ideal")),
+            ("runNoisy", lambda: session.runNoisy(qc, answer, bits)),
+            ("runBatch noisy", lambda: session.runBatch([(qc, answer, bits, 1)], "noisy")),
+            ("exactNoisySuccessProbability", lambda: session.exactNoisySuccessProbability(qc, answer, bits)))
+    for name, run in runs:
+        start = time.perf_counter()
+        try:
+            run()
+        except MemoryError as error:
+            print(name, "refused in {:.2f}s :".format(time.perf_counter() - start), error)
+        else:
+            raise AssertionError(name + " ran a 40 qubit circuit")
+    assert session.transpileCacheInfo()["misses"] == 0
+
+    # A Clifford circuit with one T gate fits the extended stabilizer method, which is only used when allowed
+    qc = QuantumCircuit(40, 2)
+    qc.h(range(40))
+    qc.t(0)
+    qc.measure([0, 1], [0, 1])
+    try:
+        session.runIdeal(qc, 0, 2)
+    except MemoryError:
+        print("Extended stabilizer refused by default")
+    else:
+        raise AssertionError("The extended stabilizer method was used without allowExtendedStabilizer")
+    session = SimulationSession(allowExtendedStabilizer=True)
+    assert session.options(qc)["method"] == "extended_stabilizer"
+    try:
+        session.exactSuccessProbability(qc, 0, 2)
+    except MemoryError as error:
+        print("exactSuccessProbability refused the extended stabilizer :", error)
+    else:
+        raise AssertionError("exactSuccessProbability used the extended stabilizer method")
+    print("______________END_OF_MEMORY_REFUSAL_______________")
+
+
+def sweepResumeTest(maxNum=2):
+    """
+    Runs a noisy sweep whose every task is pruned into a results store, then resumes it and checks that no task runs
+    again. A store holding one record of every status must only leave the failed (error and timeout) points pending.
+    Prints the results to the console
+
+    :param maxNum: The highest size input of the sweep
+    :return: None
+    """
+    tasks = expandGrid(algorithms=("QAM",), patterns=("square",), sizes=range(1, maxNum + 1), noises=("noisy",),
+                       seed=0)
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "sweep.jsonl")
+        records = runSweep(tasks, processes=1, timeout=600, store=path, minSuccess=1.0)
+        assert [record["status"] for record in records] == ["pruned"] * len(tasks), records
+        assert runSweep(tasks, processes=1, timeout=600, store=path, minSuccess=1.0) == []
+        assert len(ResultsStore(path).records()) == len(tasks)
+        print("Resumed sweep of", len(tasks), "pruned tasks ran nothing")
+
+        path = os.path.join(directory, "statuses.jsonl")
+        store = ResultsStore(path)
+        statuses = ("ok", "pruned", "error", "timeout")
+        tasks = [dict(algorithm="QAM", multiplier="1", multiplicand=bin(i + 1)[2:], limit=None, backend=None,
+                      noise="noisy", seed=0) for i in range(len(statuses))]
+        for task, status in zip(tasks, statuses):
+            store.add(dict(task, status=status))
+        pending = [statuses[tasks.index(task)] for task in ResultsStore(path).pending(tasks)]
+        assert pending == ["error", "timeout"], pending
+        assert ResultsStore(path, retryFailed=False).pending(tasks) == []
+        print("Pending after resume :", pending)
+    print("______________END_OF_SWEEP_RESUME_______________")
+
+
+def knownStateTest():
+    """
+    Checks that simplifyKnownStates leaves the final state unchanged, including a crz whose target is |0> while its
+    control is in superposition, which still applies a relative phase. Prints the gates removed in each case
+
+    :return: None
+    """
+    cases = []
+    qc = QuantumCircuit(2)
+    qc.h(0)
+    qc.crz(1.0, 0, 1)
+    cases.append(("crz with a |0> target", qc, 2))
+    qc = QuantumCircuit(2)
+    qc.h(1)
+    qc.crz(1.0, 0, 1)
+    cases.append(("crz with a |0> control", qc, 1))
+    qc = QuantumCircuit(3)
+    qc.h(2)
+    qc.cp(1.0, 2, 1)
+    qc.x(0)
+    qc.ccz(0, 1, 2)
+    cases.append(("cp and ccz with a |0> qubit", qc, 2))
+    qc = QAM.createQAMCircuit("11", "10").remove_final_measurements(inplace=False)
+    cases.append(("QAM 11 x 10", qc, None))
+    for label, qc, expected in cases:
+        simplified = simplifyKnownStates(qc)
+        assert Statevector(simplified).equiv(Statevector(qc)), label
+        assert expected is None or len(simplified.data) == expected, label
+        print(label, ": ", len(qc.data), "->", len(simplified.data), "gates")
+    print("______________END_OF_KNOWN_STATES_______________")
+
+
+def stageProfileTest(num="101"):
+    """
+    Checks that the gates counted by a StageProfiler over every stage add up to the gates of the built circuit for each
+    profiled builder, with and without bulk building and the native basis, so no pending gate is left uncounted.
+    Prints the stage totals to the console
+
+    :param num: The binary string used as both the multiplier and the multiplicand
+    :return: None
+    """
+    limit = ceil(log2(len(num) * 2) + 2)
+    builders = (("QAM", lambda **options: QAM.createQAMCircuit(num, num, **options)),
+                ("AQAM", lambda **options: AQAM.createAQAMCircuit(num, num, limit, **options)),
+                ("OPB", lambda **options: OPB.createOPBCircuit(num, num, **options)),
+                ("AOPB", lambda **options: AOPB.createAOPBCircuit(num, num, **options)),
+                ("IOPB", lambda **options: IOPB.createIOPBCircuit(num, num, **options)))
+    for name, createCircuit in builders:
+        for options in ({}, {"bulk": True}, {"nativeBasis": True}):
+            profiler = StageProfiler()
+            qc = createCircuit(profiler=profiler, **options)
+            gates = sum(1 for instruction in qc.data if not getattr(instruction.operation, "_directive", False))
+            counted = sum(stage["gates"] for stage in profiler.stages.values())
+            assert counted == gates, (name, options, counted, gates)
+            print(name, options, ": ", counted, "of", gates, "gates in", len(profiler.stages), "stages")
+    print("______________END_OF_STAGE_PROFILE_______________")
+
+
+def productSimulatorTest(maxNum=3, largeNum=20, approxNum=16):
+    """
+    Checks the product register simulator against the exact Aer probabilities for every square input up to maxNum
+    bits, then checks the sizes it supports: QAM and QFM products of largeNum bits must give the answer with
+    certainty, and an AQAM of approxNum bits (its memory limit) must finish with the entangled factor it predicts.
+    Prints the results to the console
+
+    :param maxNum: The highest size input compared with Aer
+    :param largeNum: The size of the large QAM and QFM inputs
+    :param approxNum: The size of the large AQAM input
+    :return: None
+    """
+    for i in range(1, maxNum + 1):
+        for value in range(1, 2 ** i):
+            num = bin(value)[2:].zfill(i)
+            answer = int(num, 2) ** 2
+            limit = ceil(log2(i * 2) + 2)
+            for name, qc in (("QAM", QAM.createQAMCircuit(num, num)), ("QFM", QFM.createQFMCircuit(num, num)),
+                             ("AQAM", AQAM.createAQAMCircuit(num, num, limit))):
+                probability = ProductRegisterSimulator(qc).probability(bin(answer)[2:].zfill(2 * i))
+                expected = exactSuccessProbability(qc, answer, 2 * i)[0]
+                assert abs(probability - expected) < 1e-9, (name, num, probability, expected)
+        print("Sizes", i, "match Aer")
+
+    num = "1" * largeNum
+    answer = bin(int(num, 2) ** 2)[2:].zfill(2 * largeNum)
+    for name, qc in (("QAM", QAM.createQAMCircuit(num, num)), ("QFM", QFM.createQFMCircuit(num, num))):
+        probability = ProductRegisterSimulator(qc).probability(answer)
+        assert abs(probability - 1) < 1e-9, (name, probability)
+        print(name, largeNum, "x", largeNum, "P(answer) :", probability)
+
+    num = "1" * approxNum
+    answer = bin(int(num, 2) ** 2)[2:].zfill(2 * approxNum)
+    limit = ceil(log2(approxNum * 2) + 2)
+    simulator = ProductRegisterSimulator(AQAM.createAQAMCircuit(num, num, limit))
+    probability = simulator.probability(answer)
+    largest = max(len(qubits) for qubits, state in simulator.run())
+    assert largest <= 2 * approxNum - limit and 0 < probability <= 1, (largest, probability)
+    print("AQAM", approxNum, "x", approxNum, "P(answer) :", probability, "largest factor :", largest)
+    print("______________END_OF_PRODUCT_SIMULATOR_______________")
+
+
 def ScalingAllTests(inputSize):
     """
     Runs all algorithms, up to a given input size getting the depth for each.
@@ -340,6 +629,15 @@ def main():
     # QFMTest(numToTest, timesToTest)
     # QAMTest(numToTest, timesToTest)
     # AQAMTest(numToTest, timesToTest)
+    # batchSweepTest("QAM", QAM.createQAMCircuit, numToTest, timesToTest)
+    # noiseCurveTest(4)
+    # wideCircuitTest()
+    # memoryRefusalTest()
+    # sweepResumeTest()
+    # knownStateTest()
+    # idealSweepTest()
+    # stageProfileTest()
+    # productSimulatorTest()
 
 
 if __name__ == "__main__":
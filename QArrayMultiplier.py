@@ -1,32 +1,198 @@
 from qiskit import QuantumCircuit, ClassicalRegister, QuantumRegister
 import numpy as np
-from sharedFunctions import runNoisy, runLessNoisy, runIdeal, QFT, invQFT, initializeQReg, CCP
+import time
+from sharedFunctions import runNoisy, runLessNoisy, runIdeal, QFT, invQFT, zeroQFT, semiclassicalInvQFT, \
+    initializeQReg, CCP, getTemplate, instantiateTemplate, BulkCircuit, scheduleLayers, StageProfiler, \
+    NativeCircuit, defaultSession
 
 
-def addMultRow(qc, reg_a, s, reg_b, reg_p):
+def multRowGates(reg_a, s, reg_b, reg_p):
     """
-    Performs an addition equivalent to the row addition in a classical array multiplier.
-    :param qc:       Quantum circuit that is being operated on.
+    Lists the multiple controlled phase shifts of one row of the array multiplier, in the order they are applied.
     :param reg_a:    The register holding the multiplier.
     :param s:        The current row index.
     :param reg_b:    The register holding the multiplicand.
     :param reg_p:    The register holding the product
+    :return:         A generator of (phase, control 1, control 2, target) tuples.
     """
     for b in range(0, len(reg_b)):
         for j in range(0, len(reg_b) - b):
             lam = np.pi / (2 ** (j + 1))
-            CCP(qc, lam, reg_a[s], reg_b[b], reg_p[b + j + s])
+            yield lam, reg_a[s], reg_b[b], reg_p[b + j + s]
         for i in range(0, len(reg_p) - len(reg_b) - s):
             lam = np.pi / (2 ** (b + 2 + i))
-            CCP(qc, lam, reg_a[s], reg_b[len(reg_b) - b - 1], reg_p[len(reg_b) + i + s])
+            yield lam, reg_a[s], reg_b[len(reg_b) - b - 1], reg_p[len(reg_b) + i + s]
+
+
+def addMultRow(qc, reg_a, s, reg_b, reg_p):
+    """
+    Performs an addition equivalent to the row addition in a classical array multiplier.
+    :param qc:       Quantum circuit that is being operated on.
+    :param reg_a:    The register holding the multiplier.
+    :param s:        The current row index.
+    :param reg_b:    The register holding the multiplicand.
+    :param reg_p:    The register holding the product
+    """
+    for lam, A, B, T in multRowGates(reg_a, s, reg_b, reg_p):
+        CCP(qc, lam, A, B, T)
+
+
+def addScheduledRows(qc, reg_a, reg_b, reg_p, readable=False):
+    """
+    Performs every row addition of addMultRow at once, with the phase shifts of all rows packed into layers of gates
+    on disjoint qubits so that rows overlap in depth.
+    :param qc:       Quantum circuit that is being operated on.
+    :param reg_a:    The register holding the multiplier.
+    :param reg_b:    The register holding the multiplicand.
+    :param reg_p:    The register holding the product
+    :param readable: Whether to include a barrier before each layer (will increase circuit depth).
+    """
+    gates = (gate for s in range(0, len(reg_a)) for gate in multRowGates(reg_a, s, reg_b, reg_p))
+    for i, layer in enumerate(scheduleLayers(gates)):
+        if readable: qc.barrier(label=("Layer " + str(i)))
+
+        for lam, A, B, T in layer:
+            CCP(qc, lam, A, B, T)
+
+
+def addKnownMultRow(qc, reg_a, s, reg_b, reg_p, known, controls=0):
+    """
+    Performs the row addition of addMultRow for classically known inputs. Phase shifts with a control that is "0" are
+    left out, and the remaining ones keep only the requested number of controls.
+    :param qc:       Quantum circuit that is being operated on.
+    :param reg_a:    The register holding the multiplier.
+    :param s:        The current row index.
+    :param reg_b:    The register holding the multiplicand.
+    :param reg_p:    The register holding the product
+    :param known:    A dict from each input qubit to whether its bit is "1".
+    :param controls: 2 to use the full CCP, 1 to only keep reg_b as a control, 0 for unconditional phase shifts.
+    """
+    for lam, A, B, T in multRowGates(reg_a, s, reg_b, reg_p):
+        if known[A] and known[B]:
+            # CCP shifts the phase of the target by 2 * lam when both controls are "1"
+            if controls == 2:
+                CCP(qc, lam, A, B, T)
+            elif controls == 1:
+                qc.cp(2 * lam, B, T)
+            else:
+                qc.p(2 * lam, T)
+
+
+def createQAMRegisters(len1, len2):
+    """
+    Creates the empty circuit and registers used by the QAM for the given input lengths.
+    :param len1:        The length of the multiplicand.
+    :param len2:        The length of the multiplier.
+    :return:            The circuit followed by the multiplicand, multiplier, product and classical registers.
+    """
+    qrMultiplicand = QuantumRegister(len1, name="Multiplicand")  # Multiplicand
+    qrMultiplier = QuantumRegister(len2, name="Multiplier")  # Multiplier
+    qProduct = QuantumRegister(len1 + len2, name="product")  # holds both the final multiplied result
+    CarrySum = ClassicalRegister(len1 + len2)  # Classical register to hold the final measured values
+
+    qc = QuantumCircuit(qrMultiplicand, qrMultiplier, qProduct, CarrySum, name="qc2")
+
+    return qc, qrMultiplicand, qrMultiplier, qProduct, CarrySum
 
 
-def createQAMCircuit(multiplier, multiplicand, readable=False):
+def addQAMCore(qc, qrMultiplicand, qrMultiplier, qProduct, CarrySum, readable=False, bulk=False, schedule=False,
+               stateAware=False, semiclassical=False, profiler=None, nativeBasis=False):
+    """
+    Appends every stage of the QAM that does not depend on the operand values (QFT, rows, IQFT and measurement).
+    :param qc:              Quantum circuit that is being operated on.
+    :param qrMultiplicand:  The register holding the multiplicand.
+    :param qrMultiplier:    The register holding the multiplier.
+    :param qProduct:        The register holding the product.
+    :param CarrySum:        The classical register the product is measured into.
+    :param readable:        Whether to include barriers between stages (will increase circuit depth).
+    :param bulk:            Whether to collect the gates in a BulkCircuit and append them to qc in one step.
+    :param schedule:        Whether to pack the phase shifts of all rows into parallel layers.
+    :param stateAware:      Whether to reduce the QFT of the product register, which is still |0...0>, to Hadamards.
+    :param semiclassical:   Whether to measure the product during a semiclassical inverse QFT with conditioned phases.
+    :param profiler:        A StageProfiler called at every stage boundary, or None.
+    :param nativeBasis:     Whether to write every gate in the rz/sx/x/cx basis of the backends with rotations merged,
+                            in place of bulk.
+    :return:                None
+    """
+    builder = NativeCircuit(qc) if nativeBasis else BulkCircuit(qc) if bulk else qc
+
+    if readable: builder.barrier(label="Initialized + Start QFT")
+    if profiler: profiler.stage(builder, "Initialized + Start QFT")
+
+    # Compute the Fourier transform of accumulator
+    if stateAware:
+        zeroQFT(builder, qProduct)
+    else:
+        QFT(builder, qProduct)
+
+    if schedule:
+        if profiler: profiler.stage(builder, "Scheduled Rows")
+        addScheduledRows(builder, qrMultiplicand, qrMultiplier, qProduct, readable)
+    else:
+        for i in range(0, len(qrMultiplicand)):
+            if readable: builder.barrier(label=("Start of Row " + str(i)))
+            if profiler: profiler.stage(builder, "Start of Row " + str(i))
+
+            addMultRow(builder, qrMultiplicand, i, qrMultiplier, qProduct)
+
+    if readable: builder.barrier(label="Done Looping")
+    if profiler: profiler.stage(builder, "Done Looping")
+
+    if semiclassical:
+        # Compute the inverse Fourier transform while measuring the product one qubit at a time
+        if bulk or nativeBasis: builder.flush()
+        semiclassicalInvQFT(qc, qProduct, CarrySum)
+        if profiler: profiler.stage(qc, None)
+        return
+
+    # Compute the inverse Fourier transform of accumulator
+    invQFT(builder, qProduct)
+
+    builder.measure(qProduct, CarrySum)
+
+    if bulk or nativeBasis: builder.flush()
+    if profiler: profiler.stage(builder, None)
+
+
+def getQAMTemplate(len1, len2, readable=False, bulk=False, schedule=False, stateAware=False, semiclassical=False,
+                   nativeBasis=False):
+    """
+    Returns the cached operand-independent QAM circuit for the given input lengths, building it on first use.
+    :param len1:        The length of the multiplicand.
+    :param len2:        The length of the multiplier.
+    :param readable:    Whether to include barriers between stages (will increase circuit depth).
+    :param bulk:        Whether to build the template through a BulkCircuit.
+    :param schedule:    Whether to pack the phase shifts of all rows into parallel layers.
+    :param stateAware:  Whether to reduce the QFT of the empty product register to Hadamards.
+    :param semiclassical: Whether to use the semiclassical inverse QFT.
+    :param nativeBasis: Whether to build the template in the rz/sx/x/cx basis.
+    :return:            The read-only template circuit, which has no initialization gates.
+    """
+    def build():
+        qc, *regs = createQAMRegisters(len1, len2)
+        addQAMCore(qc, *regs, readable=readable, bulk=bulk, schedule=schedule, stateAware=stateAware,
+                   semiclassical=semiclassical, nativeBasis=nativeBasis)
+        return qc
+
+    return getTemplate(("QAM", len1, len2, readable, schedule, stateAware, semiclassical, nativeBasis), build)
+
+
+def createQAMCircuit(multiplier, multiplicand, readable=False, useTemplate=False, bulk=False, schedule=False,
+                     stateAware=False, semiclassical=False, profiler=None, nativeBasis=False):
     """
     Multiply two numbers using a weighted array structure with a QFT.
     :param multiplier:  A binary string of the multiplier.
     :param multiplicand:A binary string of the multiplicand.
     :param readable:    Whether to include barriers between stages (will increase circuit depth).
+    :param useTemplate: Whether to reuse the cached circuit for these input lengths and only add the X gates.
+    :param bulk:        Whether to collect the gates as arrays and append them to the circuit in one step.
+    :param schedule:    Whether to pack the phase shifts of all rows into parallel layers, which lowers the depth.
+    :param stateAware:  Whether to reduce the QFT of the empty product register to Hadamards.
+    :param semiclassical: Whether to replace the inverse QFT and measurement by the semiclassical inverse QFT, which
+                        needs no two-qubit gates but makes the circuit dynamic.
+    :param profiler:    A StageProfiler called at every stage boundary, or None. Not used with useTemplate.
+    :param nativeBasis: Whether to write every gate in the rz/sx/x/cx basis of the backends with rotations merged,
+                        so transpiling only maps it to the device. Takes the place of bulk.
     :return:            A QC built using the two input numbers and their binary lengths.
     """
     # Take two numbers as user input in binary form
@@ -34,17 +200,52 @@ def createQAMCircuit(multiplier, multiplicand, readable=False):
     len2 = len(multiplier)
 
     if (len1 >= 1) & (len2 >= 1):
-        qrMultiplicand = QuantumRegister(len1, name="Multiplicand")  # Multiplicand
-        qrMultiplier = QuantumRegister(len2, name="Multiplier")  # Multiplier
-        qProduct = QuantumRegister(len1 + len2, name="product")  # holds both the final multiplied result
-        CarrySum = ClassicalRegister(len1 + len2)  # Classical register to hold the final measured values
+        if useTemplate:
+            template = getQAMTemplate(len1, len2, readable, bulk, schedule, stateAware, semiclassical, nativeBasis)
+            return instantiateTemplate(template, (multiplicand, multiplier))
 
-        qc = QuantumCircuit(qrMultiplicand, qrMultiplier, qProduct, CarrySum, name="qc2")
+        qc, qrMultiplicand, qrMultiplier, qProduct, CarrySum = createQAMRegisters(len1, len2)
+        if profiler: profiler.stage(qc, "Initialize")
 
         # Store bit strings in quantum registers
         initializeQReg(qc, qrMultiplicand, multiplicand)
         initializeQReg(qc, qrMultiplier, multiplier)
 
+        addQAMCore(qc, qrMultiplicand, qrMultiplier, qProduct, CarrySum, readable, bulk, schedule, stateAware,
+                   semiclassical, profiler, nativeBasis)
+
+        return qc
+
+
+def createKQAMCircuit(multiplier, multiplicand, readable=False, controls=0):
+    """
+    Multiply two classically known numbers using the array structure of the QAM, leaving out every phase shift that
+    has a "0" control. The circuit only works for the inputs it was built for.
+    :param multiplier:  A binary string of the multiplier.
+    :param multiplicand:A binary string of the multiplicand.
+    :param readable:    Whether to include barriers between stages (will increase circuit depth).
+    :param controls:    The number of controls kept on the remaining phase shifts. With 2 and all bits "1" this is the
+                        circuit of createQAMCircuit, with 0 the input registers are not needed and are left out.
+    :return:            A QC built using the two input numbers.
+    """
+    len1 = len(multiplicand)
+    len2 = len(multiplier)
+
+    if (len1 >= 1) & (len2 >= 1):
+        qc, qrMultiplicand, qrMultiplier, qProduct, CarrySum = createQAMRegisters(len1, len2)
+        if controls == 0:
+            qc = QuantumCircuit(qProduct, CarrySum, name="qc2")
+
+        known = {}
+        for reg, num in ((qrMultiplicand, multiplicand), (qrMultiplier, multiplier)):
+            for i in range(len(num)):
+                known[reg[len(num) - i - 1]] = num[i] == '1'
+
+        # Store bit strings in quantum registers
+        if controls > 0:
+            initializeQReg(qc, qrMultiplicand, multiplicand)
+            initializeQReg(qc, qrMultiplier, multiplier)
+
         if readable: qc.barrier(label="Initialized + Start QFT")
 
         # Compute the Fourier transform of accumulator
@@ -53,7 +254,7 @@ def createQAMCircuit(multiplier, multiplicand, readable=False):
         for i in range(0, len(qrMultiplicand)):
             if readable: qc.barrier(label=("Start of Row " + str(i)))
 
-            addMultRow(qc, qrMultiplicand, i, qrMultiplier, qProduct)
+            addKnownMultRow(qc, qrMultiplicand, i, qrMultiplier, qProduct, known, controls)
 
         if readable: qc.barrier(label="Done Looping")
 
@@ -65,28 +266,30 @@ def createQAMCircuit(multiplier, multiplicand, readable=False):
         return qc
 
 
-def squareQAMMultDepth(num):
+def squareQAMMultDepth(num, schedule=False):
     """
     Generates the circuit for a square multiplication and returns the resulting depth
 
     :param num: The number being used as both the multiplier and multiplicand
+    :param schedule: Whether to pack the phase shifts into parallel layers
     :return: The depth of the generated circuit
     """
-    qc = createQAMCircuit(num, num)
+    qc = createQAMCircuit(num, num, schedule=schedule)
     depth = qc.decompose().decompose().decompose().depth()
 
     del qc
     return depth
 
 
-def identityQAMMultDepth(num):
+def identityQAMMultDepth(num, schedule=False):
     """
     Generates the circuit for an identity multiplication and returns the resulting depth
 
     :param num: The number being used as the multiplicand
+    :param schedule: Whether to pack the phase shifts into parallel layers
     :return: The depth of the generated circuit
     """
-    qc = createQAMCircuit(num, "1")
+    qc = createQAMCircuit(num, "1", schedule=schedule)
     depth = qc.decompose().decompose().decompose().depth()
 
     del qc
@@ -115,8 +318,83 @@ def getDepths():
         print("____________________________________")
 
 
+def getScheduledDepths():
+    """
+    Compares the square multiplication depth before and after layer scheduling for inputs of 1 to 20 bits. Prints
+    results to the console
+
+    :return: N/A
+    """
+    print("____________________________________")
+    print("size | unscheduled | scheduled")
+    for size in range(1, 21):
+        num = "1" * size
+        print("{:4} | {:11} | {:9}".format(size, squareQAMMultDepth(num), squareQAMMultDepth(num, schedule=True)))
+    print("____________________________________")
+
+
+def getBuildTimes():
+    """
+    Times building square circuits of 8, 16 and 32 bits gate by gate and with bulk emission. Prints results to the
+    console
+
+    :return: N/A
+    """
+    print("____________________________________")
+    for size in (8, 16, 32):
+        num = "1" * size
+        start = time.perf_counter()
+        createQAMCircuit(num, num)
+        direct = time.perf_counter() - start
+        start = time.perf_counter()
+        createQAMCircuit(num, num, bulk=True)
+        bulk = time.perf_counter() - start
+        print("Build time for an input of size {}".format(size))
+        print("direct: {:.3f}s, bulk: {:.3f}s, speedup: {:.1f}x".format(direct, bulk, direct / bulk))
+        print("____________________________________")
+
+
+def getTranspileTimes():
+    """
+    Times transpiling square circuits of 4, 8 and 12 bits for the generic backend, built with cp gates and built in
+    the native basis. Prints results to the console
+
+    :return: N/A
+    """
+    print("____________________________________")
+    for size in (4, 8, 12):
+        num = "1" * size
+        times = []
+        for nativeBasis in (False, True):
+            qc = createQAMCircuit(num, num, nativeBasis=nativeBasis)
+            start = time.perf_counter()
+            transpiled = defaultSession.transpile(qc, defaultSession.backend(qc))
+            times.append(time.perf_counter() - start)
+            times.append(transpiled.count_ops().get("cx", 0))
+        print("Transpile time for an input of size {}".format(size))
+        print("cp: {:.3f}s ({} cx), native: {:.3f}s ({} cx)".format(*times))
+        print("____________________________________")
+
+
+def getStageProfile(size=16, bulk=False):
+    """
+    Profiles the stages of building a square circuit. Prints results to the console
+
+    :param size: The number of bits of the input
+    :param bulk: Whether to build with bulk emission
+    :return: N/A
+    """
+    num = "1" * size
+    profiler = StageProfiler()
+    createQAMCircuit(num, num, bulk=bulk, profiler=profiler)
+    print("Stages for an input of size {}".format(size))
+    profiler.report()
+
+
 def main():
     # getDepths()
+    # getStageProfile()
+    # getTranspileTimes()
     # Test a sample input (3x3)
     sample = "1111"
     print("b'", sample, "' x b'", sample, "'")
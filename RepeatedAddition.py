@@ -1,5 +1,6 @@
 from qiskit import QuantumRegister, QuantumCircuit, ClassicalRegister
-from sharedFunctions import QFT, invQFT, runNoisy, runLessNoisy, runIdeal, initializeQReg, evolveQFTState
+from sharedFunctions import QFT, invQFT, runNoisy, runLessNoisy, runIdeal, initializeQReg, evolveQFTState, \
+    BulkCircuit, NativeCircuit, repeatBody
 
 
 def add(reg_a, reg_b, circ, factor):
@@ -20,13 +21,50 @@ def add(reg_a, reg_b, circ, factor):
     invQFT(circ, reg_a)
 
 
-def createOPBCircuit(multiplier, multiplicand):
+def addIteration(circ, accumulator, qrMultiplicand, qrMultiplier, d, cl, measure=True, profiler=None):
+    """
+    Performs one iteration of the repeated addition, adding the multiplicand to the accumulator and then decrementing
+    and measuring the multiplier.
+    :param circ: The quantum circuit being operated on
+    :param accumulator: The register holding the product
+    :param qrMultiplicand: The register holding the multiplicand
+    :param qrMultiplier: The register holding the multiplier
+    :param d: The ancillary register set to 1
+    :param cl: The classical register the multiplier is measured into
+    :param measure: Whether to measure the multiplier after decrementing it
+    :param profiler: A StageProfiler called at every stage boundary, or None
+    :return: None
+    """
+    if profiler: profiler.stage(circ, "Add")
+    add(accumulator, qrMultiplicand, circ, 1)
+    if profiler: profiler.stage(circ, "Decrement")
+    add(qrMultiplier, d, circ, -1)
+    if measure:
+        for i in range(len(qrMultiplier)):
+            circ.measure(qrMultiplier[i], cl[i])
+
+
+def createOPBCircuit(multiplier, multiplicand, bulk=False, fold=None, shiftAdd=False, deferMeasure=False,
+                     profiler=None, nativeBasis=False):
     """
     Creates the circuit for a repeated addition
     :param multiplier: A binary string of the multiplier
     :param multiplicand: A binary string of the multiplicand
+    :param bulk: Whether to collect the gates as arrays and append them to the circuit in one step
+    :param fold: None to write out every iteration, "reference" or "loop" to build one iteration and repeat it.
+                 Cannot be combined with shiftAdd.
+    :param shiftAdd: Whether to add the shifted multiplicand once per set multiplier bit instead of repeating additions
+    :param deferMeasure: Whether to leave out the multiplier measurements of every iteration, which the product
+                         measurement overwrites, so a simulator can sample every shot from one final state
+    :param profiler: A StageProfiler called at every stage boundary, or None. A folded iteration is one stage.
+    :param nativeBasis: Whether to write every gate in the rz/sx/x/cx basis of the backends with rotations merged,
+                        so transpiling only maps it to the device. Takes the place of bulk.
     :return: a QC built using the two input numbers and their binary lengths
+    :raises ValueError: When both shiftAdd and fold are set
     """
+    if shiftAdd and fold is not None:
+        raise ValueError("shiftAdd adds each shifted multiplicand once, so there are no iterations to fold: fold must "
+                         "be None, not {!r}".format(fold))
     len1 = len(multiplicand)
     len2 = len(multiplier)
 
@@ -41,27 +79,46 @@ def createOPBCircuit(multiplier, multiplicand):
     d = QuantumRegister(1)
 
     circ = QuantumCircuit(accumulator, qrMultiplier, qrMultiplicand, d, cl, name="qc")
+    builder = NativeCircuit(circ) if nativeBasis else BulkCircuit(circ) if bulk else circ
+    if profiler: profiler.stage(builder, "Initialize")
 
     # ancillary qubit
-    circ.x(d)
+    builder.x(d)
 
     # Store bit strings in quantum registers
-    initializeQReg(circ, qrMultiplicand, multiplicand)
-    initializeQReg(circ, qrMultiplier, multiplier)
+    initializeQReg(builder, qrMultiplicand, multiplicand)
+    initializeQReg(builder, qrMultiplier, multiplier)
 
     multiplier_str = int(multiplier, 2)
 
-    # Perform repeated addition until the multiplier
-    while multiplier_str != 0:
-        add(accumulator, qrMultiplicand, circ, 1)
-        add(qrMultiplier, d, circ, -1)
-        for i in range(len(qrMultiplier)):
-            circ.measure(qrMultiplier[i], cl[i])
-        # result = execute(circ, backend=Aer.get_backend('qasm_simulator'), # Actual simulation is commented out to
-        #  shots=2).result().get_counts(circ.name)                          # reduce run-time
-        multiplier_str += -1
-
-    circ.measure(accumulator, cl)
+    if shiftAdd:
+        # Add the multiplicand shifted left by k once for each set bit k of the multiplier
+        for k in range(len2):
+            if multiplier[len2 - k - 1] == '1':
+                if profiler: profiler.stage(builder, "Add Shifted " + str(k))
+                add(accumulator, qrMultiplicand, builder, 2 ** k)
+    elif fold is None:
+        # Perform repeated addition until the multiplier
+        while multiplier_str != 0:
+            addIteration(builder, accumulator, qrMultiplicand, qrMultiplier, d, cl, not deferMeasure, profiler)
+            # result = execute(circ, backend=Aer.get_backend('qasm_simulator'), # Actual simulation is commented out to
+            #  shots=2).result().get_counts(circ.name)                          # reduce run-time
+            multiplier_str += -1
+    else:
+        # Build a single iteration and repeat it without writing its gates out again
+        if bulk or nativeBasis: builder.flush()
+        body = circ.copy_empty_like("iteration")
+        bodyBuilder = NativeCircuit(body) if nativeBasis else BulkCircuit(body) if bulk else body
+        addIteration(bodyBuilder, accumulator, qrMultiplicand, qrMultiplier, d, cl, not deferMeasure)
+        if bulk or nativeBasis: bodyBuilder.flush()
+        if profiler: profiler.stage(circ, "Repeat Iteration")
+        repeatBody(circ, body, multiplier_str, fold)
+
+    if profiler: profiler.stage(builder, "Measure")
+    builder.measure(accumulator, cl)
+
+    if bulk or nativeBasis: builder.flush()
+    if profiler: profiler.stage(builder, None)
 
     return circ
 
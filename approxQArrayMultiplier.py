@@ -1,37 +1,164 @@
-from qiskit import QuantumRegister, QuantumCircuit, ClassicalRegister
 import numpy as np
 from math import pi, log2, ceil
-from sharedFunctions import runNoisy, runLessNoisy, runIdeal, initializeQReg, CCP, AQFT, invAQFT
+from sharedFunctions import runNoisy, runLessNoisy, runIdeal, initializeQReg, CCP, AQFT, invAQFT, zeroQFT, \
+    semiclassicalInvQFT, getTemplate, instantiateTemplate, BulkCircuit, scheduleLayers, \
+    NativeCircuit
+from QArrayMultiplier import createQAMRegisters
 
 
-def addMultRow(qc, reg_a, s, reg_b, reg_p, limit):
+def multRowGates(reg_a, s, reg_b, reg_p, limit):
     """
-    Add a quantum register reg_b if reg_aVal is 1, and store the result in reg_p.
-    :param qc:      quantum circuit that is being operated on.
+    Lists the multiple controlled phase shifts of one row that are within the limit, in the order they are applied.
     :param reg_a:   the smaller of the two inputs, the multiplicand.
     :param s:       the current index of register a.
     :param reg_b:   the larger of the two inputs, the multiplier.
     :param reg_p:   the qregister holding the resultant product.
     :param limit:   the minimum size that the phase shift can be
+    :return:        a generator of (phase, control 1, control 2, target) tuples.
     """
     for b in range(0, len(reg_b)):
         for j in range(0, len(reg_b) - b):
             lam = np.pi / (2 ** (j + 1))
             if abs((j + 1)) <= limit:
-                CCP(qc, lam, reg_a[s], reg_b[b], reg_p[b + j + s])
+                yield lam, reg_a[s], reg_b[b], reg_p[b + j + s]
         for i in range(0, len(reg_p) - len(reg_b) - s):
             lam = np.pi / (2 ** (b + 2 + i))
             if abs((b + 2 + i)) <= limit:
-                CCP(qc, lam, reg_a[s], reg_b[len(reg_b) - b - 1], reg_p[len(reg_b) + i + s])
+                yield lam, reg_a[s], reg_b[len(reg_b) - b - 1], reg_p[len(reg_b) + i + s]
+
+
+def addMultRow(qc, reg_a, s, reg_b, reg_p, limit):
+    """
+    Add a quantum register reg_b if reg_aVal is 1, and store the result in reg_p.
+    :param qc:      quantum circuit that is being operated on.
+    :param reg_a:   the smaller of the two inputs, the multiplicand.
+    :param s:       the current index of register a.
+    :param reg_b:   the larger of the two inputs, the multiplier.
+    :param reg_p:   the qregister holding the resultant product.
+    :param limit:   the minimum size that the phase shift can be
+    """
+    for lam, A, B, T in multRowGates(reg_a, s, reg_b, reg_p, limit):
+        CCP(qc, lam, A, B, T)
+
+
+def addScheduledRows(qc, reg_a, reg_b, reg_p, limit, readable=False):
+    """
+    Performs every row addition of addMultRow at once, packing the phase shifts into layers on disjoint qubits.
+    :param qc:       quantum circuit that is being operated on.
+    :param reg_a:    the smaller of the two inputs, the multiplicand.
+    :param reg_b:    the larger of the two inputs, the multiplier.
+    :param reg_p:    the qregister holding the resultant product.
+    :param limit:    the minimum size that the phase shift can be
+    :param readable: whether to include a barrier before each layer (will increase circuit depth)
+    """
+    gates = (gate for s in range(0, len(reg_a)) for gate in multRowGates(reg_a, s, reg_b, reg_p, limit))
+    for i, layer in enumerate(scheduleLayers(gates)):
+        if readable: qc.barrier(label=("Layer " + str(i)))
+
+        for lam, A, B, T in layer:
+            CCP(qc, lam, A, B, T)
+
+
+def addAQAMCore(qc, qrMultiplicand, qrMultiplier, qProduct, CarrySum, limit, readable=False, bulk=False,
+                schedule=False, stateAware=False, semiclassical=False, profiler=None, nativeBasis=False):
+    """
+    Appends every stage of the AQAM that does not depend on the operand values (AQFT, rows, IAQFT and measurement).
+    :param qc: Quantum circuit that is being operated on.
+    :param qrMultiplicand: The register holding the multiplicand.
+    :param qrMultiplier: The register holding the multiplier.
+    :param qProduct: The register holding the product.
+    :param CarrySum: The classical register the product is measured into.
+    :param limit: The smallest acceptable phase shift to be performed.
+    :param readable: Whether to include barriers between stages (will increase circuit depth)
+    :param bulk: Whether to collect the gates in a BulkCircuit and append them to qc in one step
+    :param schedule: Whether to pack the phase shifts of all rows into parallel layers
+    :param stateAware: Whether to reduce the AQFT of the product register, which is still |0...0>, to Hadamards
+    :param semiclassical: Whether to measure the product during a semiclassical inverse AQFT with conditioned phases
+    :param profiler: A StageProfiler called at every stage boundary, or None
+    :param nativeBasis: Whether to write every gate in the rz/sx/x/cx basis of the backends with rotations merged, in
+                        place of bulk
+    :return: None
+    """
+    builder = NativeCircuit(qc) if nativeBasis else BulkCircuit(qc) if bulk else qc
+
+    if readable: builder.barrier(label="Initialized + Start QFT")
+    if profiler: profiler.stage(builder, "Initialized + Start QFT")
+
+    # Compute the Fourier transform of accumulator
+    if stateAware:
+        zeroQFT(builder, qProduct)
+    else:
+        AQFT(builder, qProduct, limit)
+
+    if schedule:
+        if profiler: profiler.stage(builder, "Scheduled Rows")
+        addScheduledRows(builder, qrMultiplicand, qrMultiplier, qProduct, limit, readable)
+    else:
+        for i in range(0, len(qrMultiplicand)):
+            if readable: builder.barrier(label=("Start of Row " + str(i)))
+            if profiler: profiler.stage(builder, "Start of Row " + str(i))
+
+            addMultRow(builder, qrMultiplicand, i, qrMultiplier, qProduct, limit)
+
+    if readable: builder.barrier(label="Done Looping")
+    if profiler: profiler.stage(builder, "Done Looping")
+
+    if semiclassical:
+        # Compute the inverse Fourier transform while measuring the product one qubit at a time
+        if bulk or nativeBasis: builder.flush()
+        semiclassicalInvQFT(qc, qProduct, CarrySum, limit)
+        if profiler: profiler.stage(qc, None)
+        return
+
+    # Compute the inverse Fourier transform of accumulator
+    invAQFT(builder, qProduct, limit)
+
+    builder.measure(qProduct, CarrySum)
+
+    if bulk or nativeBasis: builder.flush()
+    if profiler: profiler.stage(builder, None)
+
+
+def getAQAMTemplate(len1, len2, limit, readable=False, bulk=False, schedule=False, stateAware=False,
+                    semiclassical=False, nativeBasis=False):
+    """
+    Returns the cached operand-independent AQAM circuit for the given input lengths and limit.
+    :param len1: The length of the multiplicand.
+    :param len2: The length of the multiplier.
+    :param limit: The smallest acceptable phase shift to be performed.
+    :param readable: Whether to include barriers between stages (will increase circuit depth)
+    :param bulk: Whether to build the template through a BulkCircuit
+    :param schedule: Whether to pack the phase shifts of all rows into parallel layers
+    :param stateAware: Whether to reduce the AQFT of the empty product register to Hadamards
+    :param semiclassical: Whether to use the semiclassical inverse AQFT
+    :param nativeBasis: Whether to build the template in the rz/sx/x/cx basis
+    :return: The read-only template circuit, which has no initialization gates.
+    """
+    def build():
+        qc, *regs = createQAMRegisters(len1, len2)
+        addAQAMCore(qc, *regs, limit, readable=readable, bulk=bulk, schedule=schedule, stateAware=stateAware,
+                    semiclassical=semiclassical, nativeBasis=nativeBasis)
+        return qc
+
+    return getTemplate(("AQAM", len1, len2, limit, readable, schedule, stateAware, semiclassical, nativeBasis), build)
 
 
-def createAQAMCircuit(multiplier, multiplicand, limit, readable=False):
+def createAQAMCircuit(multiplier, multiplicand, limit, readable=False, useTemplate=False, bulk=False,
+                      schedule=False, stateAware=False, semiclassical=False, profiler=None, nativeBasis=False):
     """
     Multiply two numbers using a structure of the array multiplier, along with a phase limitation.
     :param multiplier: A binary string of the multiplier ie) "011"
     :param multiplicand: A binary string of the multiplicand ie) "001"
     :param limit: The smallest acceptable phase shift to be performed.
     :param readable: Whether to include barriers between stages (will increase circuit depth)
+    :param useTemplate: Whether to reuse the cached circuit for these lengths and limit and only add the X gates
+    :param bulk: Whether to collect the gates as arrays and append them to the circuit in one step
+    :param schedule: Whether to pack the phase shifts of all rows into parallel layers, which lowers the depth
+    :param stateAware: Whether to reduce the AQFT of the empty product register to Hadamards
+    :param semiclassical: Whether to replace the inverse AQFT and measurement by the semiclassical inverse AQFT
+    :param profiler: A StageProfiler called at every stage boundary, or None. Not used with useTemplate
+    :param nativeBasis: Whether to write every gate in the rz/sx/x/cx basis of the backends with rotations merged,
+                        so transpiling only maps it to the device. Takes the place of bulk
     :return: a QC built using the two input numbers and their binary lengths
     """
     # Take two numbers as user input in binary form
@@ -39,46 +166,34 @@ def createAQAMCircuit(multiplier, multiplicand, limit, readable=False):
     len2 = len(multiplier)
 
     if (len1 >= 1) & (len2 >= 1):
-        qrMultiplicand = QuantumRegister(len1, name="Multiplicand")  # Multiplicand
-        qrMultiplier = QuantumRegister(len2, name="Multiplier")  # Multiplier
-        qProduct = QuantumRegister(len1 + len2, name="product")  # holds both the final multiplied result
-        CarrySum = ClassicalRegister(len1 + len2)  # Classical register to hold the final measured values
+        if useTemplate:
+            template = getAQAMTemplate(len1, len2, limit, readable, bulk, schedule, stateAware, semiclassical,
+                                       nativeBasis)
+            return instantiateTemplate(template, (multiplicand, multiplier))
 
-        qc = QuantumCircuit(qrMultiplicand, qrMultiplier, qProduct, CarrySum, name="qc2")
+        qc, qrMultiplicand, qrMultiplier, qProduct, CarrySum = createQAMRegisters(len1, len2)
+        if profiler: profiler.stage(qc, "Initialize")
 
         # Store bit strings in quantum registers
         initializeQReg(qc, qrMultiplicand, multiplicand)
         initializeQReg(qc, qrMultiplier, multiplier)
 
-        if readable: qc.barrier(label="Initialized + Start QFT")
-
-        # Compute the Fourier transform of accumulator
-        AQFT(qc, qProduct, limit)
-
-        for i in range(0, len(qrMultiplicand)):
-            if readable: qc.barrier(label=("Start of Row " + str(i)))
-
-            addMultRow(qc, qrMultiplicand, i, qrMultiplier, qProduct, limit)
-
-        if readable: qc.barrier(label="Done Looping")
-
-        # Compute the inverse Fourier transform of accumulator
-        invAQFT(qc, qProduct, limit)
-
-        qc.measure(qProduct, CarrySum)
+        addAQAMCore(qc, qrMultiplicand, qrMultiplier, qProduct, CarrySum, limit, readable, bulk, schedule,
+                    stateAware, semiclassical, profiler, nativeBasis)
 
         return qc
 
 
-def squareAQAMMultDepth(num, limit):
+def squareAQAMMultDepth(num, limit, schedule=False):
     """
     Generates the circuit for a square multiplication and returns the resulting depth
 
     :param num: The number being used as both the multiplier and multiplicand
     :param limit: the minimum size that the phase shift can be
+    :param schedule: Whether to pack the phase shifts into parallel layers
     :return: The depth of the generated circuit
     """
-    qc = createAQAMCircuit(num, num, limit)
+    qc = createAQAMCircuit(num, num, limit, schedule=schedule)
     depth = qc.decompose().decompose().decompose().depth()
 
     del qc
@@ -128,6 +243,23 @@ def getDepths():
         print("____________________________________")
 
 
+def getScheduledDepths():
+    """
+    Compares the square multiplication depth before and after layer scheduling for inputs of 1 to 20 bits, using the
+    same limit as getDepths. Prints results to the console.
+
+    :return: N/A
+    """
+    print("____________________________________")
+    print("size | unscheduled | scheduled")
+    for size in range(1, 21):
+        num = "1" * size
+        limit = ceil(log2(size * 2) + 2)
+        print("{:4} | {:11} | {:9}".format(size, squareAQAMMultDepth(num, limit),
+                                            squareAQAMMultDepth(num, limit, schedule=True)))
+    print("____________________________________")
+
+
 def main():
     # Get all depths defined in the following function
     getDepths()
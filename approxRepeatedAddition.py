@@ -1,5 +1,6 @@
 from qiskit import QuantumRegister, QuantumCircuit, ClassicalRegister
-from sharedFunctions import AQFT, invAQFT, runNoisy, runLessNoisy, runIdeal, initializeQReg, evolveAQFTState
+from sharedFunctions import AQFT, invAQFT, runNoisy, runLessNoisy, runIdeal, initializeQReg, evolveAQFTState, \
+    BulkCircuit, NativeCircuit, repeatBody, zeroQFT, semiclassicalInvQFT
 
 import numpy as np
 from math import pi, log2, ceil
@@ -32,13 +33,66 @@ def sub1(qc, reg_a):
                 qc.p(-1 * pi / float(2 ** j), reg_a[n])
 
 
-def createAOPBCircuit(multiplier, multiplicand, readable=False):
+def addIteration(qc, accumulator, qrMultiplicand, qrMultiplier, cl, limit, readable=False, measure=True,
+                 profiler=None):
+    """
+    Performs one iteration of the repeated addition, adding the multiplicand to the accumulator and then decrementing
+    and measuring the multiplier.
+    :param qc: The quantum circuit being operated on.
+    :param accumulator: The register holding the product, in the phase domain.
+    :param qrMultiplicand: The register holding the multiplicand.
+    :param qrMultiplier: The register holding the multiplier.
+    :param cl: The classical register the multiplier is measured into.
+    :param limit: The smallest acceptable phase shift to be performed.
+    :param readable: Whether to include barriers between stages (will increase circuit depth)
+    :param measure: Whether to measure the multiplier after decrementing it
+    :param profiler: A StageProfiler called at every stage boundary, or None
+    :return: None
+    """
+    if readable: qc.barrier(label="Add")
+    if profiler: profiler.stage(qc, "Add")
+    add(qc, accumulator, qrMultiplicand, 1, limit)
+    if readable: qc.barrier(label="begin decrement")
+    if profiler: profiler.stage(qc, "begin decrement")
+    # Compute the Fourier transform of multiplier
+    AQFT(qc, qrMultiplier, limit)
+
+    sub1(qc, qrMultiplier)
+
+    # Compute the inverse Fourier transform of multiplier
+    invAQFT(qc, qrMultiplier, limit)
+
+
+    # measure current multiplier state
+    if measure:
+        for i in range(len(qrMultiplier)):
+            qc.measure(qrMultiplier[i], cl[i])
+    if readable: qc.barrier(label="End Decrement")
+
+
+def createAOPBCircuit(multiplier, multiplicand, readable=False, bulk=False, fold=None, shiftAdd=False,
+                      stateAware=False, semiclassical=False, deferMeasure=False, profiler=None, nativeBasis=False):
     """
     Creates the circuit for a repeated addition
     :param multiplier: A binary string of the multiplier
     :param multiplicand: A binary string of the multiplicand
+    :param bulk: Whether to collect the gates as arrays and append them to the circuit in one step
+    :param fold: None to write out every iteration, "reference" or "loop" to build one iteration and repeat it.
+                 Cannot be combined with shiftAdd.
+    :param shiftAdd: Whether to add the shifted multiplicand once per set multiplier bit instead of repeating additions
+    :param stateAware: Whether to reduce the QFT of the accumulator, which is still |0...0>, to Hadamards
+    :param semiclassical: Whether to measure the accumulator during a semiclassical inverse AQFT with conditioned phases
+    :param deferMeasure: Whether to leave out the multiplier measurements of every iteration, which the product
+                         measurement overwrites, so a simulator can sample every shot from one final state
+    :param profiler: A StageProfiler called at every stage boundary, or None. A folded iteration is one stage.
+    :param nativeBasis: Whether to write every gate in the rz/sx/x/cx basis of the backends with rotations merged,
+                        so transpiling only maps it to the device. Takes the place of bulk.
     :return: a QC built using the two input numbers and their binary lengths
+    :raises ValueError: When both shiftAdd and fold are set
     """
+    if shiftAdd and fold is not None:
+        raise ValueError("shiftAdd adds each shifted multiplicand once, so there are no iterations to fold: fold must "
+                         "be None, not {!r}".format(fold))
     len1 = len(multiplicand)
     len2 = len(multiplier)
 
@@ -56,49 +110,70 @@ def createAOPBCircuit(multiplier, multiplicand, readable=False):
     cl = ClassicalRegister(len1 + len2)
 
     qc = QuantumCircuit(accumulator, qrMultiplier, qrMultiplicand, cl, name="qc")
+    builder = NativeCircuit(qc) if nativeBasis else BulkCircuit(qc) if bulk else qc
+    if profiler: profiler.stage(builder, "Initialize")
 
     for i in range(len1):
         if multiplicand[i] == '1':
-            qc.x(qrMultiplicand[len1 - i - 1])
+            builder.x(qrMultiplicand[len1 - i - 1])
 
     for i in range(len2):
         if multiplier[i] == '1':
-            qc.x(qrMultiplier[len2 - i - 1])
+            builder.x(qrMultiplier[len2 - i - 1])
 
-    if readable: qc.barrier(label="Initialized + Start QFT")
+    if readable: builder.barrier(label="Initialized + Start QFT")
+    if profiler: profiler.stage(builder, "Initialized + Start QFT")
 
-    AQFT(qc, accumulator, limit)
+    if stateAware:
+        zeroQFT(builder, accumulator)
+    else:
+        AQFT(builder, accumulator, limit)
 
-    if readable: qc.barrier(label=("End QFT"))
+    if readable: builder.barrier(label=("End QFT"))
+    if profiler: profiler.stage(builder, "End QFT")
 
     multiplier_str = int(multiplier, 2)
-    # Perform repeated addition until the multiplier
-    # is zero
-    while multiplier_str != 0:
-        if readable: qc.barrier(label="Add")
-        add(qc, accumulator, qrMultiplicand, 1, limit)
-        if readable: qc.barrier(label="begin decrement")
-        # Compute the Fourier transform of multiplier
-        AQFT(qc, qrMultiplier, limit)
-
-        sub1(qc, qrMultiplier)
-
-        # Compute the inverse Fourier transform of multiplier
-        invAQFT(qc, qrMultiplier, limit)
-
-
-        # measure current multiplier state
-        for i in range(len(qrMultiplier)):
-            qc.measure(qrMultiplier[i], cl[i])
-        if readable: qc.barrier(label="End Decrement")
-        multiplier_str += -1
+    if shiftAdd:
+        # Add the multiplicand shifted left by k once for each set bit k of the multiplier
+        for k in range(len2):
+            if multiplier[len2 - k - 1] == '1':
+                if readable: builder.barrier(label="Add Shifted " + str(k))
+                if profiler: profiler.stage(builder, "Add Shifted " + str(k))
+                add(builder, accumulator, qrMultiplicand, 2 ** k, limit)
+    elif fold is None:
+        # Perform repeated addition until the multiplier
+        # is zero
+        while multiplier_str != 0:
+            addIteration(builder, accumulator, qrMultiplicand, qrMultiplier, cl, limit, readable, not deferMeasure,
+                         profiler)
+            multiplier_str += -1
+    else:
+        # Build a single iteration and repeat it without writing its gates out again
+        if bulk or nativeBasis: builder.flush()
+        body = qc.copy_empty_like("iteration")
+        bodyBuilder = NativeCircuit(body) if nativeBasis else BulkCircuit(body) if bulk else body
+        addIteration(bodyBuilder, accumulator, qrMultiplicand, qrMultiplier, cl, limit, readable,
+                     not deferMeasure)
+        if bulk or nativeBasis: bodyBuilder.flush()
+        if profiler: profiler.stage(qc, "Repeat Iteration")
+        repeatBody(qc, body, multiplier_str, fold)
 
     # Compute the inverse Fourier transform of accumulator
-    if readable: qc.barrier(label="Begin IAQFT")
-    invAQFT(qc, accumulator, limit)
-    if readable: qc.barrier(label="End IAQFT")
-
-    qc.measure(accumulator, cl)
+    if readable: builder.barrier(label="Begin IAQFT")
+    if profiler: profiler.stage(builder, "Begin IAQFT")
+    if semiclassical:
+        if bulk or nativeBasis: builder.flush()
+        semiclassicalInvQFT(qc, accumulator, cl, limit)
+        if profiler: profiler.stage(qc, None)
+        return qc
+    invAQFT(builder, accumulator, limit)
+    if readable: builder.barrier(label="End IAQFT")
+    if profiler: profiler.stage(builder, "End IAQFT")
+
+    builder.measure(accumulator, cl)
+
+    if bulk or nativeBasis: builder.flush()
+    if profiler: profiler.stage(builder, None)
 
     # add(qc, accumulator, qrMultiplicand, 1, limit)
     return qc
@@ -0,0 +1,165 @@
+from datetime import datetime, timezone
+import platform
+import time
+import tracemalloc
+
+import qiskit
+import qiskit_aer
+from qiskit import transpile
+
+from sharedFunctions import SimulationSession
+from resultsStore import ResultsStore
+from sweepRunner import ALGORITHMS, operands, defaultLimit
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+
+# How many decompose calls reach the basic gates, as in the getDepths of each module
+DECOMPOSITIONS = {"OPB": 3, "IOPB": 3, "AOPB": 3, "QFM": 5, "QAM": 3, "AQAM": 3}
+
+
+def measurePhase(phase, traceMemory=True):
+    """
+    Runs one phase of the benchmark while timing it and tracing the Python memory it allocates. Tracing slows down
+    the Python parts of a phase, so the times of traced and untraced runs should not be compared.
+    :param phase: A function without arguments
+    :param traceMemory: Whether to trace the memory
+    :return: The result of phase, its wall time in seconds and the peak memory traced during it in bytes (or None)
+    """
+    if not traceMemory:
+        start = time.perf_counter()
+        result = phase()
+        return result, time.perf_counter() - start, None
+    tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        result = phase()
+        elapsed = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def maxRss():
+    """
+    :return: The peak resident memory of this process in bytes, including the memory Aer allocates outside of Python,
+             or None where the resource module is missing
+    """
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if platform.system() == "Darwin" else rss * 1024
+
+
+def benchmarkCircuit(algorithm, multiplier, multiplicand, session, shots=1024, maxSimulatedQubits=20,
+                     traceMemory=True):
+    """
+    Times building, decomposing, transpiling and running one circuit on the ideal simulator. The decomposed circuit
+    is the one that is run, since Aer does not know the library gate of the QFM.
+    :param algorithm: A name from sweepRunner.ALGORITHMS
+    :param multiplier: A binary string of the multiplier
+    :param multiplicand: A binary string of the multiplicand
+    :param session: The SimulationSession that provides the backend and simulator
+    :param shots: The number of shots of the run
+    :param maxSimulatedQubits: Circuits with more qubits are built, decomposed and transpiled but not run
+    :param traceMemory: Whether to trace the peak Python memory of every phase
+    :return: A record dict with the circuit figures, the time and peak traced memory of every phase and the process
+             peak memory afterwards. The phases that were not run are None.
+    """
+    limit = defaultLimit(multiplier, multiplicand) if algorithm == "AQAM" else None
+    build = ALGORITHMS[algorithm][0]
+
+    qc, buildTime, buildPeak = measurePhase(lambda: build(multiplier, multiplicand, limit), traceMemory)
+
+    def decompose():
+        decomposed = qc
+        for _ in range(DECOMPOSITIONS[algorithm]):
+            decomposed = decomposed.decompose()
+        return decomposed
+
+    decomposed, decomposeTime, decomposePeak = measurePhase(decompose, traceMemory)
+    ops = decomposed.count_ops()
+    backend = session.backend(qc)
+    transpiled, transpileTime, transpilePeak = measurePhase(lambda: transpile(qc, backend), traceMemory)
+
+    simulateTime = simulatePeak = None
+    if qc.num_qubits <= maxSimulatedQubits:
+        sim = session.idealSimulator()
+        options = session.options(decomposed)
+        _, simulateTime, simulatePeak = measurePhase(lambda: sim.run(decomposed, shots=shots, **options).result(),
+                                                     traceMemory)
+
+    return {"algorithm": algorithm, "multiplier": multiplier, "multiplicand": multiplicand, "limit": limit,
+            "qubits": qc.num_qubits, "depth": decomposed.depth(),
+            "gates": sum(ops.values()) - ops.get("measure", 0) - ops.get("barrier", 0), "cx": ops.get("cx", 0),
+            "transpiledDepth": transpiled.depth(), "shots": shots,
+            "buildTime": buildTime, "decomposeTime": decomposeTime, "transpileTime": transpileTime,
+            "simulateTime": simulateTime, "buildPeak": buildPeak, "decomposePeak": decomposePeak,
+            "transpilePeak": transpilePeak, "simulatePeak": simulatePeak, "maxRss": maxRss()}
+
+
+def runBenchmarks(algorithms=tuple(ALGORITHMS), patterns=("identity", "square", "random"), sizes=range(1, 4),
+                  seed=0, output="benchmark.jsonl", shots=1024, maxSimulatedQubits=20, traceMemory=True):
+    """
+    Benchmarks every algorithm for every operand pattern and size and appends one JSON record per circuit to output.
+    Records carry the qiskit and Aer versions and the time of the run so results of different runs can be compared.
+
+    :param algorithms: Names from sweepRunner.ALGORITHMS
+    :param patterns: Operand patterns, see sweepRunner.operands
+    :param sizes: Operand sizes in bits
+    :param seed: The seed of the "random" operands and the generated backends
+    :param output: The JSON Lines file the records are appended to, or None to only return them
+    :param shots: The number of shots of every run
+    :param maxSimulatedQubits: Circuits with more qubits are not run
+    :param traceMemory: Whether to trace the peak Python memory of every phase, the records say which was used
+    :return: The list of records
+    """
+    session = SimulationSession(seed=seed)
+    store = None if output is None else ResultsStore(output)
+    started = datetime.now(timezone.utc).isoformat()
+    records = []
+    for algorithm in algorithms:
+        for pattern in patterns:
+            for size in sizes:
+                multiplier, multiplicand = operands(pattern, size, seed)
+                if algorithm == "QFM" and len(multiplier) != len(multiplicand):
+                    continue
+                record = benchmarkCircuit(algorithm, multiplier, multiplicand, session, shots, maxSimulatedQubits,
+                                          traceMemory)
+                record.update(pattern=pattern, size=size, seed=seed, traceMemory=traceMemory, started=started,
+                              qiskit=qiskit.__version__, aer=qiskit_aer.__version__,
+                              python=platform.python_version())
+                records.append(record)
+                if store is not None:
+                    store.add(record)
+    return records
+
+
+def printBenchmarks(records):
+    """
+    Prints the phase times of every record to the console
+
+    :param records: The records returned by runBenchmarks
+    :return: N/A
+    """
+    print("____________________________________")
+    for record in records:
+        simulateTime = "-" if record["simulateTime"] is None else "{:.3f}s".format(record["simulateTime"])
+        print("{} {} {} x {}: build {:.3f}s, decompose {:.3f}s, transpile {:.3f}s, run {}, peak {:.1f} MB".format(
+            record["algorithm"], record["pattern"], record["multiplier"], record["multiplicand"], record["buildTime"],
+            record["decomposeTime"], record["transpileTime"], simulateTime,
+            max(peak or 0 for peak in (record["buildPeak"], record["decomposePeak"], record["transpilePeak"],
+                                       record["simulatePeak"])) / 2 ** 20))
+    print("____________________________________")
+
+
+def main():
+    printBenchmarks(runBenchmarks())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,355 @@
+from math import ceil, log2, pi, sqrt
+import time
+
+import numpy as np
+from qiskit.circuit import ControlFlowOp
+
+from sharedFunctions import printAnswer
+import QArrayMultiplier as QAM
+import approxQArrayMultiplier as AQAM
+import QFourierMultiplier as QFM
+
+
+# Gates the simulator handles directly, everything else is replaced by its definition
+_knownGates = {"x", "h", "p", "cx", "cp", "mcphase", "swap", "measure", "barrier", "id"}
+
+
+def flattenCircuit(qc):
+    """
+    Lists the instructions of a circuit, replacing every gate the simulator does not know by its definition
+    :param qc: The quantum circuit being simulated
+    :return: A list of (operation, qubit indices, clbit indices) tuples
+    """
+    qubitIndex = {bit: i for i, bit in enumerate(qc.qubits)}
+    clbitIndex = {bit: i for i, bit in enumerate(qc.clbits)}
+    flat = []
+    _flatten(qc, [qubitIndex[bit] for bit in qc.qubits], [clbitIndex[bit] for bit in qc.clbits], flat)
+    return flat
+
+
+def _flatten(qc, qubits, clbits, flat):
+    qubitIndex = {bit: qubits[i] for i, bit in enumerate(qc.qubits)}
+    clbitIndex = {bit: clbits[i] for i, bit in enumerate(qc.clbits)}
+    for instruction in qc.data:
+        operation = instruction.operation
+        q = [qubitIndex[bit] for bit in instruction.qubits]
+        c = [clbitIndex[bit] for bit in instruction.clbits]
+        if isinstance(operation, ControlFlowOp) or getattr(operation, "condition", None) is not None:
+            raise ValueError("The product register simulator does not support classically controlled operations")
+        if operation.name in _knownGates:
+            flat.append((operation, q, c))
+        elif operation.definition is not None:
+            _flatten(operation.definition, q, c, flat)
+        else:
+            raise ValueError("The product register simulator does not support the gate " + operation.name)
+
+
+class ProductRegisterSimulator:
+    """
+    Ideal simulator for circuits whose operand registers stay in computational basis states, like the QAM, AQAM and
+    QFM. Every qubit in a basis state is tracked as a classical bit, so every controlled phase with a classical control
+    becomes either nothing or a phase on the remaining qubits. The qubits that leave the basis states are held as a
+    product of small state vectors (factors), which are only merged when a gate entangles them and are split again
+    when a Hadamard or cx leaves one of their qubits in a basis state or unentangled with the rest.
+    The QFT of a basis state, the phase additions and the inverse QFT of an exact product never entangle the product
+    qubits, so the QAM and QFM stay a product of one qubit factors and scale with the number of gates (a 32x32 QAM
+    simulates in under a second). The phases the AQAM leaves out entangle the product register into one factor of
+    len1 + len2 - limit qubits, so the AQAM is limited by memory to about 16x16 bits (a 25 qubit factor of 512 MB,
+    simulated in about 5 s).
+    """
+
+    def __init__(self, qc):
+        """
+        :param qc: The quantum circuit being simulated
+        """
+        self.flat = flattenCircuit(qc)
+        self.numClbits = qc.num_clbits
+        self.cregs = [[qc.find_bit(bit).index for bit in creg] for creg in qc.cregs]
+        self.bits = {q: 0 for q in range(qc.num_qubits)}   # classical qubit -> bit value
+        self.factors = {}       # quantum qubit -> [qubits, state] of the factor holding it, shared by its qubits
+        self._measured = {}     # clbit -> ("q", qubit) or ("c", bit value)
+        self._measuredQubits = set()
+        self._ran = False
+
+    # ----------------------State Updates---------------------------
+    @staticmethod
+    def _slice(factor, *fixed):
+        index = [slice(None)] * len(factor[0])
+        for q, value in fixed:
+            index[factor[0].index(q)] = value
+        return tuple(index)
+
+    def _quantum(self, q):
+        # Moves a classical qubit into a factor of its own and returns that factor
+        if q in self.factors:
+            return self.factors[q]
+        state = np.zeros(2, dtype=np.complex128)
+        state[self.bits.pop(q)] = 1
+        self.factors[q] = [[q], state]
+        return self.factors[q]
+
+    def _merge(self, qubits):
+        # Merges the factors holding the given quantum qubits into one and returns it
+        factors = list({id(self.factors[q]): self.factors[q] for q in qubits}.values())
+        if len(factors) == 1:
+            return factors[0]
+        merged = [sum((factor[0] for factor in factors), []), factors[0][1]]
+        for factor in factors[1:]:
+            merged[1] = np.multiply.outer(merged[1], factor[1])
+        for q in merged[0]:
+            self.factors[q] = merged
+        return merged
+
+    def _split(self, q, tolerance=1e-12):
+        # Separates q from the rest of its factor when the factor is a product of a state of q and a state of the rest
+        factor = self.factors[q]
+        axis = factor[0].index(q)
+        matrix = np.moveaxis(factor[1], axis, 0).reshape(2, -1)
+        norms = np.einsum("ij,ij->i", matrix, matrix.conj()).real
+        rest = [other for other in factor[0] if other != q]
+        if min(norms) < tolerance:
+            value = int(norms[1] > norms[0])
+            del self.factors[q]
+            self.bits[q] = value
+            remaining = matrix[value] / sqrt(norms[value])
+        elif rest and abs(np.vdot(matrix[0], matrix[1])) ** 2 > norms[0] * norms[1] * (1 - tolerance):
+            value = int(norms[1] > norms[0])
+            remaining = matrix[value] / sqrt(norms[value])
+            self.factors[q] = [[q], matrix @ remaining.conj()]
+        else:
+            return
+        if rest:
+            remaining = remaining.reshape((2,) * len(rest))
+            factor[0][:] = rest
+            factor[1] = remaining
+            for other in rest:
+                self.factors[other] = factor
+
+    def _phase(self, theta, qubits):
+        # Controlled phase on the given quantum qubits, after the classical controls have been resolved. The angle is
+        # reduced first, so the whole turns the QFM builds as 2 * pi * 2 ** k are identities instead of rounding errors
+        # of up to 1e-4 that entangle the product register
+        theta %= 2 * pi
+        if len(qubits) == 0 or theta == 0:
+            return
+        factor = self._merge(qubits)
+        factor[1][self._slice(factor, *((q, 1) for q in qubits))] *= np.exp(1j * theta)
+
+    def _x(self, q):
+        if q not in self.factors:
+            self.bits[q] ^= 1
+            return
+        factor = self.factors[q]
+        factor[1] = np.flip(factor[1], factor[0].index(q))
+
+    def _h(self, q):
+        factor = self._quantum(q)
+        zero = factor[1][self._slice(factor, (q, 0))].copy()
+        one = factor[1][self._slice(factor, (q, 1))]
+        factor[1][self._slice(factor, (q, 0))] = (zero + one) / sqrt(2)
+        factor[1][self._slice(factor, (q, 1))] = (zero - one) / sqrt(2)
+        self._split(q)
+
+    def _cx(self, c, t):
+        self._quantum(t)
+        factor = self._merge([c, t])
+        zero = factor[1][self._slice(factor, (c, 1), (t, 0))].copy()
+        factor[1][self._slice(factor, (c, 1), (t, 0))] = factor[1][self._slice(factor, (c, 1), (t, 1))]
+        factor[1][self._slice(factor, (c, 1), (t, 1))] = zero
+        self._split(t)
+        if c in self.factors:
+            self._split(c)
+
+    def _swap(self, a, b):
+        # Exchanges the roles of the two qubits
+        factorA, factorB = self.factors.pop(a, None), self.factors.pop(b, None)
+        bitA, bitB = self.bits.pop(a, None), self.bits.pop(b, None)
+        for factor in {id(f): f for f in (factorA, factorB) if f is not None}.values():
+            factor[0][:] = [b if other == a else a if other == b else other for other in factor[0]]
+        if factorA is not None:
+            self.factors[b] = factorA
+        else:
+            self.bits[b] = bitA
+        if factorB is not None:
+            self.factors[a] = factorB
+        else:
+            self.bits[a] = bitB
+
+    def apply(self, operation, qubits, clbits):
+        """
+        Applies one instruction of the flattened circuit
+        :param operation: The operation
+        :param qubits: Its qubit indices
+        :param clbits: Its clbit indices
+        :return: None
+        """
+        name = operation.name
+        if name not in ("barrier", "measure") and any(q in self._measuredQubits for q in qubits):
+            raise ValueError("The product register simulator only supports measurements at the end of the circuit")
+
+        if name in ("barrier", "id"):
+            return
+        if name == "measure":
+            q = qubits[0]
+            if q in self.factors:
+                self._measured[clbits[0]] = ("q", q)
+                self._measuredQubits.add(q)
+            else:
+                self._measured[clbits[0]] = ("c", self.bits[q])
+        elif name == "x":
+            self._x(qubits[0])
+        elif name == "h":
+            self._h(qubits[0])
+        elif name in ("p", "cp", "mcphase"):
+            # Every classical control that is 0 turns the phase off, the ones that are 1 can be left out
+            if all(self.bits[q] for q in qubits if q not in self.factors):
+                self._phase(float(operation.params[0]), [q for q in qubits if q in self.factors])
+        elif name == "cx":
+            c, t = qubits
+            if c in self.factors:
+                self._cx(c, t)
+            elif self.bits[c]:
+                self._x(t)
+        elif name == "swap":
+            self._swap(*qubits)
+
+    def run(self):
+        """
+        Applies every instruction of the circuit, the first time it is called
+        :return: The factors of the final state, as a list of (qubits, state vector with the qubits as axes) pairs
+        """
+        if not self._ran:
+            for operation, qubits, clbits in self.flat:
+                self.apply(operation, qubits, clbits)
+            self._ran = True
+        return [(factor[0], factor[1]) for factor in {id(f): f for f in self.factors.values()}.values()]
+
+    def probability(self, key):
+        """
+        Reads the probability of one outcome from the factors, without listing the other outcomes. Use this over
+        probabilities when the final state is spread over many outcomes, like for the AQAM
+        :param key: A measured bit string, formatted like Aer counts
+        :return: The probability of measuring it
+        """
+        factors = self.run()
+        order = [clbit for creg in reversed(self.cregs) for clbit in reversed(creg)]
+        clbitValues = dict(zip(order, (int(bit) for bit in key.replace(" ", ""))))
+        if any(clbitValues[clbit] for clbit in clbitValues if clbit not in self._measured):
+            return 0.0
+        if any(value[0] == "c" and clbitValues[clbit] != value[1] for clbit, value in self._measured.items()):
+            return 0.0
+
+        probability = 1.0
+        for qubits, state in factors:
+            index = [slice(None)] * len(qubits)
+            for clbit, value in self._measured.items():
+                if value[0] == "q" and value[1] in qubits:
+                    axis = qubits.index(value[1])
+                    if isinstance(index[axis], int) and index[axis] != clbitValues[clbit]:
+                        return 0.0
+                    index[axis] = clbitValues[clbit]
+            probability *= float(np.sum(np.abs(state[tuple(index)]) ** 2))
+        return probability
+
+    def probabilities(self, cutoff=1e-12):
+        """
+        :param cutoff: The probability under which outcomes are left out
+        :return: A dict from every measured bit string (formatted like Aer counts) to its probability
+        """
+        clbitValues = [0] * self.numClbits
+        outcomes = [([], 1.0)]
+        for qubits, state in self.run():
+            # Marginal distribution of the measured qubits of each factor, which are independent of each other
+            measured = [(clbit, qubits.index(value[1])) for clbit, value in self._measured.items()
+                        if value[0] == "q" and value[1] in qubits]
+            keep = sorted({axis for clbit, axis in measured})
+            marginal = np.abs(state) ** 2
+            marginal = marginal.sum(axis=tuple(a for a in range(len(qubits)) if a not in keep))
+            factorOutcomes = []
+            for flatIndex in np.flatnonzero(marginal.reshape(-1) > cutoff):
+                values = dict(zip(keep, np.unravel_index(flatIndex, (2,) * len(keep))))
+                factorOutcomes.append(([(clbit, int(values[axis])) for clbit, axis in measured],
+                                       float(marginal.reshape(-1)[flatIndex])))
+            outcomes = [(assigned + more, probability * factorProbability) for assigned, probability in outcomes
+                        for more, factorProbability in factorOutcomes if probability * factorProbability > cutoff]
+        for clbit, value in self._measured.items():
+            if value[0] == "c":
+                clbitValues[clbit] = value[1]
+
+        results = {}
+        for assigned, probability in outcomes:
+            values = list(clbitValues)
+            for clbit, value in assigned:
+                values[clbit] = value
+            key = self._format(values)
+            results[key] = results.get(key, 0) + probability
+        return results
+
+    def _format(self, clbitValues):
+        return " ".join("".join(str(clbitValues[i]) for i in reversed(creg)) for creg in reversed(self.cregs))
+
+
+def simulateProduct(qc, shots=1024, seed=None):
+    """
+    Runs a circuit on the product register simulator
+    :param qc: The pre-created quantum circuit to be run, whose operand registers stay in basis states
+    :param shots: The number of samples drawn from the final distribution
+    :param seed: The seed for sampling, or None
+    :return: The counts of the simulation, formatted like Aer counts
+    """
+    probabilities = ProductRegisterSimulator(qc).probabilities()
+    keys = list(probabilities)
+    weights = np.array([probabilities[key] for key in keys])
+    samples = np.random.default_rng(seed).multinomial(shots, weights / weights.sum())
+    return {key: int(count) for key, count in zip(keys, samples) if count > 0}
+
+
+def runProductIdeal(qc, answer, bits, printAll=False, shots=1024):
+    """
+    Runs the provided circuit without noise on the product register simulator, like runIdeal
+    :param qc: The pre-created quantum circuit to be run
+    :param answer: The expected answer for the multiplication
+    :param bits: how many bits there will be in the output
+    :param printAll: Whether to print all the counts or just those for the answer
+    :param shots: The number of shots
+    :return: The counts of the simulation
+    """
+    counts = simulateProduct(qc, shots)
+    printAnswer(counts, answer, bits, printAll, "ideal")
+    return counts
+
+
+def getVerificationTimes():
+    """
+    Checks square multiplications of 4 to 24 bits with the QAM and QFM, and of up to 16 bits with the AQAM, on the
+    product register simulator and times them. Prints results to the console
+
+    :return: N/A
+    """
+    print("____________________________________")
+    for size in range(4, 25, 4):
+        num = "1" * size
+        answer = bin(int(num, 2) ** 2)[2:].zfill(2 * size)
+        limit = ceil(log2(size * 2) + 2)
+        circuits = [("QAM", QAM.createQAMCircuit(num, num)), ("QFM", QFM.createQFMCircuit(num, num))]
+        if size <= 16:
+            circuits.append(("AQAM", AQAM.createAQAMCircuit(num, num, limit)))
+        for name, qc in circuits:
+            start = time.perf_counter()
+            simulator = ProductRegisterSimulator(qc)
+            probability = simulator.probability(answer)
+            largest = max((len(qubits) for qubits, state in simulator.run()), default=0)
+            print("{} {}x{} bits ({} qubits, largest factor {}): P(answer) = {:.4f} in {:.2f}s".format(
+                name, size, size, qc.num_qubits, largest, probability, time.perf_counter() - start))
+    print("____________________________________")
+
+
+def main():
+    sample = "101"
+    qc = QFM.createQFMCircuit(sample, sample)
+    runProductIdeal(qc, int(sample, 2) ** 2, len(sample) * 2)
+    getVerificationTimes()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,558 @@
+from math import log2, ceil
+import time
+
+from sharedFunctions import QFT, invQFT, AQFT, invAQFT, initializeQReg, zeroQFT
+import QArrayMultiplier as QAM
+import approxQArrayMultiplier as AQAM
+import RepeatedAddition as OPB
+import ImpRepAddition as IOPB
+import approxRepeatedAddition as AOPB
+
+
+class ResourceCounter:
+    """
+    Stand-in for a QuantumCircuit that the circuit components (QFT, CCP, addMultRow, ...) can write into. Instead of
+    storing gates it counts them and tracks the depth that qc.decompose().decompose().decompose().depth() would report,
+    where every cp becomes p, cx, p, cx, p and every other gate stays a single gate.
+    Registers are plain ranges of wire indices, created through qreg and creg.
+    """
+
+    def __init__(self):
+        self.qLevels = []
+        self.cLevels = []
+        self.gates = 0
+        self.cx_count = 0
+        self.measures = 0
+        self.stages = {}
+        self._stage = None
+        self._stageStart = None
+        self._links = None
+
+    def qreg(self, size):
+        """
+        Adds size qubits to the counter
+        :param size: The number of qubits in the register
+        :return: A range of the qubit indices, used in place of a QuantumRegister
+        """
+        start = len(self.qLevels)
+        self.qLevels.extend([0] * size)
+        return range(start, start + size)
+
+    def creg(self, size):
+        """
+        Adds size classical bits to the counter
+        :param size: The number of bits in the register
+        :return: A range of the bit indices, used in place of a ClassicalRegister
+        """
+        start = len(self.cLevels)
+        self.cLevels.extend([0] * size)
+        return range(start, start + size)
+
+    def depth(self):
+        return max(self.qLevels + self.cLevels, default=0)
+
+    def snapshot(self):
+        return self.depth(), self.gates, self.cx_count, self.measures
+
+    # ----------------------Gates---------------------------
+    def _single(self, q):
+        if isinstance(q, range):
+            for i in q:
+                self._single(i)
+            return
+        self.qLevels[q] += 1
+        self.gates += 1
+        if self._links is not None:
+            self._links.append((q, q))
+
+    def x(self, q):
+        self._single(q)
+
+    def h(self, q):
+        self._single(q)
+
+    def p(self, theta, q):
+        self._single(q)
+
+    def cx(self, c, t):
+        levels = self.qLevels
+        level = max(levels[c], levels[t]) + 1
+        levels[c] = level
+        levels[t] = level
+        self.gates += 1
+        self.cx_count += 1
+        if self._links is not None:
+            self._links.append((c, t))
+
+    def cp(self, theta, c, t):
+        # p(c), cx(c, t), p(t), cx(c, t), p(t)
+        levels = self.qLevels
+        level = max(levels[c] + 1, levels[t]) + 1
+        levels[c] = level + 2
+        levels[t] = level + 3
+        self.gates += 5
+        self.cx_count += 2
+        if self._links is not None:
+            self._links.append((c, t))
+
+    def measure(self, q, c):
+        if isinstance(q, range):
+            for i, j in zip(q, c):
+                self.measure(i, j)
+            return
+        level = max(self.qLevels[q], self.cLevels[c]) + 1
+        self.qLevels[q] = level
+        self.cLevels[c] = level
+        self.measures += 1
+        if self._links is not None:
+            self._links.append((q, len(self.qLevels) + c))
+
+    def barrier(self, *args, **kwargs):
+        # Barriers are directives and are not counted by depth()
+        pass
+
+    # ----------------------Stages---------------------------
+    def stage(self, name):
+        """
+        Closes the current stage and starts counting a new one. Stages with the same name are accumulated.
+        :param name: The name of the stage being started, or None to only close the current stage
+        :return: None
+        """
+        if self._stage is not None:
+            start = self._stageStart
+            now = self.snapshot()
+            totals = self.stages.setdefault(self._stage, {"depth": 0, "gates": 0, "cx": 0, "measure": 0})
+            for key, before, after in zip(("depth", "gates", "cx", "measure"), start, now):
+                totals[key] += after - before
+        self._stage = name
+        self._stageStart = self.snapshot()
+
+    def repeat(self, body, iterations):
+        """
+        Runs body() iterations times. The wires of the body are split into the groups that interact with each other.
+        Once one iteration shifts every wire of each group by the same amount, the remaining iterations are
+        extrapolated exactly instead of being counted one by one.
+        :param body: A function with no arguments that writes one iteration into the counter
+        :param iterations: The number of times the body is repeated
+        :return: None
+        """
+        groups = None
+        done = 0
+        while done < iterations:
+            beforeLevels = self.qLevels + self.cLevels
+            before = (self.gates, self.cx_count, self.measures)
+            beforeStages = {name: dict(totals) for name, totals in self.stages.items()}
+            if groups is None:
+                self._links = []
+            body()
+            self.stage(None)
+            done += 1
+            if groups is None:
+                groups = self._linkedGroups()
+                self._links = None
+            if done == iterations:
+                break
+
+            levels = self.qLevels + self.cLevels
+            shifts = {}
+            for wire, group in groups.items():
+                shifts.setdefault(group, set()).add(levels[wire] - beforeLevels[wire])
+            if all(len(shift) == 1 for shift in shifts.values()):
+                left = iterations - done
+                for wire, group in groups.items():
+                    levels[wire] += next(iter(shifts[group])) * left
+                self.qLevels = levels[:len(self.qLevels)]
+                self.cLevels = levels[len(self.qLevels):]
+                self.gates += (self.gates - before[0]) * left
+                self.cx_count += (self.cx_count - before[1]) * left
+                self.measures += (self.measures - before[2]) * left
+                for name, totals in self.stages.items():
+                    start = beforeStages.get(name, {})
+                    for key in totals:
+                        totals[key] += (totals[key] - start.get(key, 0)) * left
+                done = iterations
+
+    def _linkedGroups(self):
+        """
+        Groups the wires recorded while running a loop body by the instructions that connect them
+        :return: A dict from each touched wire (clbits are offset by the number of qubits) to its group id
+        """
+        parent = {}
+
+        def find(wire):
+            while parent.setdefault(wire, wire) != wire:
+                parent[wire] = parent[parent[wire]]
+                wire = parent[wire]
+            return wire
+
+        for a, b in self._links:
+            parent[find(a)] = find(b)
+        return {wire: find(wire) for wire in parent}
+
+    def report(self):
+        """
+        Closes the current stage and summarizes everything counted
+        :return: A dict holding the depth, gates, cx and measure totals along with the per-stage breakdown
+        """
+        self.stage(None)
+        return {"depth": self.depth(), "gates": self.gates, "cx": self.cx_count, "measure": self.measures,
+                "stages": self.stages}
+
+
+# ----------------------Closed Forms---------------------------
+# Decomposed sizes of the blocks, cp is p, cx, p, cx, p and CCP is three cp and two cx
+CP_GATES, CP_CX = 5, 2
+CCP_GATES, CCP_CX = 3 * CP_GATES + 2, 3 * CP_CX + 2
+
+
+def qftPhaseCount(size, limit=None):
+    """
+    Counts the controlled phase shifts of the (approximate) QFT of a register, the inverse transform has as many
+    :param size: The length of the register
+    :param limit: The smallest acceptable phase shift to be performed, or None for the exact QFT
+    :return: The number of cp gates
+    """
+    if limit is None or limit >= size - 1:
+        return size * (size - 1) // 2
+    return limit * (limit + 1) // 2 + limit * (size - 1 - limit)
+
+
+def rowPhaseCount(len1, len2, limit=None):
+    """
+    Counts the multiple controlled phase shifts of every row of the (approximate) quantum array multiplier, as listed
+    by multRowGates
+    :param len1: The length of the multiplicand, which is the number of rows
+    :param len2: The length of the multiplier
+    :param limit: The AQAM phase limit, or None for the exact QAM
+    :return: The number of CCP gates
+    """
+    if limit is None:
+        return len1 * len2 * (len2 + 1) // 2 + len2 * len1 * (len1 + 1) // 2
+    total = 0
+    for s in range(len1):
+        for b in range(len2):
+            total += min(len2 - b, limit) + max(0, min(len1 - s, limit - b - 1))
+    return total
+
+
+def QAMCounts(multiplier, multiplicand, limit=None, stateAware=False):
+    """
+    Counts the gates of the (approximate) quantum array multiplier from the closed forms of its blocks, in time that
+    does not depend on the number of gates. The depth is not modelled and is left as None.
+    :param multiplier: A binary string of the multiplier
+    :param multiplicand: A binary string of the multiplicand
+    :param limit: The AQAM phase limit, or None for the exact QAM
+    :param stateAware: Whether to count the Hadamard layer that replaces the QFT of the empty product register
+    :return: A dict like the report of a ResourceCounter, with None for every depth
+    """
+    size = len(multiplicand) + len(multiplier)
+    qftPhases = 0 if stateAware else qftPhaseCount(size, limit)
+    iqftPhases = qftPhaseCount(size, limit)
+    rows = rowPhaseCount(len(multiplicand), len(multiplier), limit)
+    stages = {
+        "init": {"depth": None, "gates": (multiplicand + multiplier).count("1"), "cx": 0, "measure": 0},
+        "QFT": {"depth": None, "gates": size + CP_GATES * qftPhases, "cx": CP_CX * qftPhases, "measure": 0},
+        "rows": {"depth": None, "gates": CCP_GATES * rows, "cx": CCP_CX * rows, "measure": 0},
+        "IQFT": {"depth": None, "gates": size + CP_GATES * iqftPhases, "cx": CP_CX * iqftPhases, "measure": 0},
+        "measure": {"depth": None, "gates": 0, "cx": 0, "measure": size},
+    }
+    report = {key: sum(totals[key] for totals in stages.values()) for key in ("gates", "cx", "measure")}
+    report.update(depth=None, stages=stages)
+    return report
+
+
+# ----------------------Models---------------------------
+def QAMResources(multiplier, multiplicand, limit=None, schedule=False, stateAware=False, depth=True):
+    """
+    Counts the resources of the (approximate) quantum array multiplier without building the circuit. The depth is
+    found by walking every gate through a ResourceCounter, which takes about a second for 64 bit inputs, so
+    depth=False returns the closed-form counts of QAMCounts instead.
+    :param multiplier: A binary string of the multiplier, only its length is used
+    :param multiplicand: A binary string of the multiplicand, only its length is used
+    :param limit: The AQAM phase limit, or None for the exact QAM
+    :param schedule: Whether to count the layer-scheduled rows of the circuit
+    :param stateAware: Whether to count the Hadamard layer that replaces the QFT of the empty product register
+    :param depth: Whether to model the depth, otherwise only the gate counts are computed and the depths are None
+    :return: The report of a ResourceCounter ie) {"depth": .., "gates": .., "cx": .., "measure": .., "stages": {..}}
+    """
+    if not depth:
+        return QAMCounts(multiplier, multiplicand, limit, stateAware)
+    len1 = len(multiplicand)
+    len2 = len(multiplier)
+    rc = ResourceCounter()
+    qrMultiplicand = rc.qreg(len1)
+    qrMultiplier = rc.qreg(len2)
+    qProduct = rc.qreg(len1 + len2)
+    CarrySum = rc.creg(len1 + len2)
+
+    rc.stage("init")
+    initializeQReg(rc, qrMultiplicand, multiplicand)
+    initializeQReg(rc, qrMultiplier, multiplier)
+
+    rc.stage("QFT")
+    if stateAware:
+        zeroQFT(rc, qProduct)
+    elif limit is None:
+        QFT(rc, qProduct)
+    else:
+        AQFT(rc, qProduct, limit)
+
+    rc.stage("rows")
+    if schedule:
+        if limit is None:
+            QAM.addScheduledRows(rc, qrMultiplicand, qrMultiplier, qProduct)
+        else:
+            AQAM.addScheduledRows(rc, qrMultiplicand, qrMultiplier, qProduct, limit)
+    else:
+        for i in range(0, len1):
+            if limit is None:
+                QAM.addMultRow(rc, qrMultiplicand, i, qrMultiplier, qProduct)
+            else:
+                AQAM.addMultRow(rc, qrMultiplicand, i, qrMultiplier, qProduct, limit)
+
+    rc.stage("IQFT")
+    if limit is None:
+        invQFT(rc, qProduct)
+    else:
+        invAQFT(rc, qProduct, limit)
+
+    rc.stage("measure")
+    rc.measure(qProduct, CarrySum)
+    return rc.report()
+
+
+def OPBResources(multiplier, multiplicand, shiftAdd=False, deferMeasure=False):
+    """
+    Counts the resources of the repeated addition multiplier without building the circuit
+    :param multiplier: A binary string of the multiplier
+    :param multiplicand: A binary string of the multiplicand
+    :param shiftAdd: Whether to count the shift-and-add variant of the circuit
+    :param deferMeasure: Whether to leave out the multiplier measurements of every iteration
+    :return: The report of a ResourceCounter
+    """
+    len1 = len(multiplicand)
+    len2 = len(multiplier)
+    if len2 > len1:
+        multiplier, multiplicand = multiplicand, multiplier
+        len2, len1 = len1, len2
+
+    rc = ResourceCounter()
+    accumulator = rc.qreg(len1 + len2)
+    qrMultiplier = rc.qreg(len2)
+    qrMultiplicand = rc.qreg(len1)
+    d = rc.qreg(1)
+    cl = rc.creg(len1 + len2)
+
+    rc.stage("init")
+    rc.x(d)
+    initializeQReg(rc, qrMultiplicand, multiplicand)
+    initializeQReg(rc, qrMultiplier, multiplier)
+
+    def iteration():
+        rc.stage("add")
+        OPB.add(accumulator, qrMultiplicand, rc, 1)
+        rc.stage("decrement")
+        OPB.add(qrMultiplier, d, rc, -1)
+        if not deferMeasure:
+            for i in range(len(qrMultiplier)):
+                rc.measure(qrMultiplier[i], cl[i])
+
+    if shiftAdd:
+        rc.stage("add")
+        for k in range(len2):
+            if multiplier[len2 - k - 1] == '1':
+                OPB.add(accumulator, qrMultiplicand, rc, 2 ** k)
+    else:
+        rc.repeat(iteration, int(multiplier, 2))
+
+    rc.stage("measure")
+    rc.measure(accumulator, cl)
+    return rc.report()
+
+
+def IOPBResources(multiplier, multiplicand, limit=None, shiftAdd=False, stateAware=False, deferMeasure=False):
+    """
+    Counts the resources of the improved (or approximate) repeated addition multiplier without building the circuit
+    :param multiplier: A binary string of the multiplier
+    :param multiplicand: A binary string of the multiplicand
+    :param limit: The AOPB phase limit, or None for the IOPB
+    :param shiftAdd: Whether to count the shift-and-add variant of the circuit
+    :param stateAware: Whether to count the Hadamard layer that replaces the QFT of the empty accumulator
+    :param deferMeasure: Whether to leave out the multiplier measurements of every iteration
+    :return: The report of a ResourceCounter
+    """
+    len1 = len(multiplicand)
+    len2 = len(multiplier)
+    if len2 > len1:
+        multiplier, multiplicand = multiplicand, multiplier
+        len2, len1 = len1, len2
+
+    rc = ResourceCounter()
+    accumulator = rc.qreg(len1 + len2)
+    qrMultiplier = rc.qreg(len2)
+    qrMultiplicand = rc.qreg(len1)
+    cl = rc.creg(len1 + len2)
+
+    rc.stage("init")
+    initializeQReg(rc, qrMultiplicand, multiplicand)
+    initializeQReg(rc, qrMultiplier, multiplier)
+
+    rc.stage("QFT")
+    if stateAware:
+        zeroQFT(rc, accumulator)
+    elif limit is None:
+        QFT(rc, accumulator)
+    else:
+        AQFT(rc, accumulator, limit)
+
+    def iteration():
+        rc.stage("add")
+        if limit is None:
+            IOPB.add(rc, accumulator, qrMultiplicand, 1)
+        else:
+            AOPB.add(rc, accumulator, qrMultiplicand, 1, limit)
+        rc.stage("decrement")
+        if limit is None:
+            QFT(rc, qrMultiplier)
+            IOPB.sub1(rc, qrMultiplier)
+            invQFT(rc, qrMultiplier)
+        else:
+            AQFT(rc, qrMultiplier, limit)
+            AOPB.sub1(rc, qrMultiplier)
+            invAQFT(rc, qrMultiplier, limit)
+        if not deferMeasure:
+            for i in range(len(qrMultiplier)):
+                rc.measure(qrMultiplier[i], cl[i])
+
+    if shiftAdd:
+        rc.stage("add")
+        for k in range(len2):
+            if multiplier[len2 - k - 1] == '1':
+                if limit is None:
+                    IOPB.add(rc, accumulator, qrMultiplicand, 2 ** k)
+                else:
+                    AOPB.add(rc, accumulator, qrMultiplicand, 2 ** k, limit)
+    else:
+        rc.repeat(iteration, int(multiplier, 2))
+
+    rc.stage("IQFT")
+    if limit is None:
+        invQFT(rc, accumulator)
+    else:
+        invAQFT(rc, accumulator, limit)
+
+    rc.stage("measure")
+    rc.measure(accumulator, cl)
+    return rc.report()
+
+
+def AOPBResources(multiplier, multiplicand, shiftAdd=False, stateAware=False, deferMeasure=False):
+    """
+    Counts the resources of the approximate repeated addition multiplier, using the same limit as createAOPBCircuit
+    :param multiplier: A binary string of the multiplier
+    :param multiplicand: A binary string of the multiplicand
+    :param shiftAdd: Whether to count the shift-and-add variant of the circuit
+    :param stateAware: Whether to count the Hadamard layer that replaces the QFT of the empty accumulator
+    :param deferMeasure: Whether to leave out the multiplier measurements of every iteration
+    :return: The report of a ResourceCounter
+    """
+    limit = ceil(log2(len(multiplicand) + len(multiplier)) + 2)
+    return IOPBResources(multiplier, multiplicand, limit, shiftAdd, stateAware, deferMeasure)
+
+
+# ----------------------Validation---------------------------
+def circuitResources(qc):
+    """
+    Computes the same figures as the models from a built circuit using the decompose chain used by getDepths
+    :param qc: The circuit to measure
+    :return: A dict holding the depth, gates, cx and measure totals
+    """
+    decomposed = qc.decompose().decompose().decompose()
+    ops = decomposed.count_ops()
+    measures = ops.get("measure", 0)
+    gates = sum(ops.values()) - measures - ops.get("barrier", 0)
+    return {"depth": decomposed.depth(), "gates": gates, "cx": ops.get("cx", 0), "measure": measures}
+
+
+def validate(maxNum=4):
+    """
+    Compares every model against the decompose based numbers for identity and square inputs up to maxNum bits.
+    Prints any mismatch to the console.
+
+    :param maxNum: The largest input size to compare
+    :return: True if every model matched
+    """
+    cases = [
+        ("QAM", lambda a, b: QAM.createQAMCircuit(a, b), lambda a, b: QAMResources(a, b)),
+        ("AQAM", lambda a, b: AQAM.createAQAMCircuit(a, b, 3), lambda a, b: QAMResources(a, b, 3)),
+        ("scheduled QAM", lambda a, b: QAM.createQAMCircuit(a, b, schedule=True),
+         lambda a, b: QAMResources(a, b, schedule=True)),
+        ("scheduled AQAM", lambda a, b: AQAM.createAQAMCircuit(a, b, 3, schedule=True),
+         lambda a, b: QAMResources(a, b, 3, schedule=True)),
+        ("state-aware QAM", lambda a, b: QAM.createQAMCircuit(a, b, stateAware=True),
+         lambda a, b: QAMResources(a, b, stateAware=True)),
+        ("closed-form QAM", lambda a, b: QAM.createQAMCircuit(a, b), lambda a, b: QAMResources(a, b, depth=False)),
+        ("closed-form AQAM", lambda a, b: AQAM.createAQAMCircuit(a, b, 3),
+         lambda a, b: QAMResources(a, b, 3, depth=False)),
+        ("closed-form state-aware AQAM", lambda a, b: AQAM.createAQAMCircuit(a, b, 3, stateAware=True),
+         lambda a, b: QAMResources(a, b, 3, stateAware=True, depth=False)),
+        ("OPB", OPB.createOPBCircuit, OPBResources),
+        ("IOPB", IOPB.createIOPBCircuit, IOPBResources),
+        ("AOPB", AOPB.createAOPBCircuit, AOPBResources),
+        ("shift-and-add OPB", lambda a, b: OPB.createOPBCircuit(a, b, shiftAdd=True),
+         lambda a, b: OPBResources(a, b, shiftAdd=True)),
+        ("shift-and-add IOPB", lambda a, b: IOPB.createIOPBCircuit(a, b, shiftAdd=True),
+         lambda a, b: IOPBResources(a, b, shiftAdd=True)),
+        ("state-aware IOPB", lambda a, b: IOPB.createIOPBCircuit(a, b, stateAware=True),
+         lambda a, b: IOPBResources(a, b, stateAware=True)),
+        ("shift-and-add AOPB", lambda a, b: AOPB.createAOPBCircuit(a, b, shiftAdd=True),
+         lambda a, b: AOPBResources(a, b, shiftAdd=True)),
+        ("deferred OPB", lambda a, b: OPB.createOPBCircuit(a, b, deferMeasure=True),
+         lambda a, b: OPBResources(a, b, deferMeasure=True)),
+        ("deferred IOPB", lambda a, b: IOPB.createIOPBCircuit(a, b, deferMeasure=True),
+         lambda a, b: IOPBResources(a, b, deferMeasure=True)),
+        ("deferred AOPB", lambda a, b: AOPB.createAOPBCircuit(a, b, deferMeasure=True),
+         lambda a, b: AOPBResources(a, b, deferMeasure=True)),
+    ]
+    matched = True
+    for name, build, model in cases:
+        for size in range(1, maxNum + 1):
+            num = "1" * size
+            for multiplier, multiplicand in ((num, num), ("1", num), (num, "1")):
+                expected = circuitResources(build(multiplier, multiplicand))
+                modelled = model(multiplier, multiplicand)
+                for key in expected:
+                    if modelled[key] is not None and expected[key] != modelled[key]:
+                        matched = False
+                        print("{} {} x {}: {} is {}, model gives {}".format(name, multiplier, multiplicand, key,
+                                                                            expected[key], modelled[key]))
+    return matched
+
+
+def getDepths():
+    """
+    Prints the modelled depth and gate counts of the QAM and AQAM for square inputs, including sizes far beyond what
+    can be built and decomposed. Sizes past 128 bits only get the closed-form gate counts.
+
+    :return: N/A
+    """
+    print("____________________________________")
+    for size in (8, 16, 32, 64, 128, 1024):
+        num = "1" * size
+        limit = ceil(log2(size * 2) + 2)
+        for name, args in (("QAM", ()), ("AQAM", (limit,))):
+            start = time.perf_counter()
+            resources = QAMResources(num, num, *args, depth=size <= 128)
+            elapsed = time.perf_counter() - start
+            print("{} square input of size {}: depth {}, gates {}, cx {} ({:.3f}s)".format(
+                name, size, resources["depth"], resources["gates"], resources["cx"], elapsed))
+        print("____________________________________")
+
+
+def main():
+    print("Model matches decompose based numbers:", validate())
+    getDepths()
+
+
+if __name__ == "__main__":
+    main()
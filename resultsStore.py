@@ -0,0 +1,93 @@
+import json
+import os
+
+
+# The fields that identify a sweep point, two records with the same values describe the same run
+KEY_FIELDS = ("algorithm", "multiplier", "multiplicand", "limit", "backend", "noise", "seed")
+
+
+def recordKey(record):
+    """
+    :param record: A task or record dict
+    :return: The tuple of its KEY_FIELDS values, missing fields are None
+    """
+    return tuple(record.get(field) for field in KEY_FIELDS)
+
+
+class ResultsStore:
+    """
+    Append-only JSON Lines file of sweep records, one JSON object per line. Records are written and flushed to disk as
+    soon as they are added, so everything finished before a crash is kept and the sweep can resume from it.
+    """
+
+    def __init__(self, path, retryFailed=True):
+        """
+        :param path: The .jsonl file, created on the first add if it does not exist
+        :param retryFailed: Whether points whose only records have an "error" or "timeout" status are run again
+        """
+        self.path = path
+        self.retryFailed = retryFailed
+        self._done = set()
+        self._partialLine = False
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            with open(path, "rb") as file:
+                file.seek(-1, os.SEEK_END)
+                self._partialLine = file.read(1) != b"\n"
+        for record in self.records():
+            self._remember(record)
+
+    def _remember(self, record):
+        # Pruned points were estimated on purpose, only errors and timeouts are worth running again
+        if record.get("status", "ok") in ("ok", "pruned") or not self.retryFailed:
+            self._done.add(recordKey(record))
+
+    def records(self):
+        """
+        Reads every record in the file. A partly written last line, left by a crash during a write, is ignored.
+        :return: A list of record dicts in the order they were added
+        """
+        if not os.path.exists(self.path):
+            return []
+        records = []
+        with open(self.path) as file:
+            for line in file:
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue
+        return records
+
+    def add(self, record):
+        """
+        Appends a record to the file and flushes it to disk
+        :param record: A JSON serializable dict holding the KEY_FIELDS
+        :return: None
+        """
+        with open(self.path, "a") as file:
+            if self._partialLine:
+                file.write("\n")
+                self._partialLine = False
+            file.write(json.dumps(record, sort_keys=True) + "\n")
+            file.flush()
+            os.fsync(file.fileno())
+        self._remember(record)
+
+    def __contains__(self, task):
+        return recordKey(task) in self._done
+
+    def pending(self, tasks):
+        """
+        :param tasks: A list of task dicts
+        :return: The tasks that have no record yet, in the same order
+        """
+        return [task for task in tasks if task not in self]
+
+
+def main():
+    store = ResultsStore("results.jsonl")
+    for record in store.records():
+        print(json.dumps(record, sort_keys=True))
+
+
+if __name__ == "__main__":
+    main()
@@ -2,8 +2,22 @@ from qiskit_aer import AerSimulator
 import qiskit_aer.noise as noise
 from qiskit_aer.noise import NoiseModel
 from qiskit.providers.fake_provider import GenericBackendV2
-from qiskit import transpile
-from math import pi
+from qiskit import transpile, QuantumCircuit, qpy
+from qiskit.circuit import CircuitInstruction, QuantumRegister, ClassicalRegister
+from qiskit.circuit.library import XGate, HGate, PhaseGate, CXGate, CPhaseGate, Measure, Barrier, RZGate, SXGate
+from qiskit.circuit import ForLoopOp, ControlFlowOp
+from qiskit_aer.utils import insert_noise
+from qiskit_aer.noise.device import basic_device_gate_errors, basic_device_readout_errors
+from qiskit.quantum_info import process_fidelity
+from collections import Counter, OrderedDict, namedtuple
+from functools import lru_cache
+from array import array
+from math import pi, sqrt
+import hashlib
+import os
+import time
+import warnings
+import numpy as np
 
 
 # ----------------------Circuit Components---------------------------
@@ -30,6 +44,9 @@ def CCP(qc, theta, A, B, T):
     :param T: Target
     :return: None
     """
+    if isinstance(qc, NativeCircuit):
+        qc.ccp(theta, A, B, T)
+        return
     qc.cp(theta, B, T)
     qc.cx(A, B)
     qc.cp(-theta, B, T)
@@ -37,6 +54,88 @@ def CCP(qc, theta, A, B, T):
     qc.cp(theta, A, T)
 
 
+QFT_CACHE_SIZE = 256
+
+
+@lru_cache(maxsize=QFT_CACHE_SIZE)
+def qftTable(size, limit=None, inverse=False):
+    """
+    Lists the gates of the (approximate, inverse) quantum Fourier transform of a register, computed once per shape.
+    :param size: The length of the register
+    :param limit: The smallest acceptable phase shift to be performed, or None for the exact QFT
+    :param inverse: Whether to list the inverse transform
+    :return: A tuple of (operation, register indices) pairs. The operations are shared and must not be modified.
+    """
+    table = []
+    if not inverse:
+        for i in range(0, size):
+            n = size - 1 - i
+            table.append((HGate(), (n,)))
+            for j in range(0, n):
+                if limit is None or abs((j + 1)) <= limit:
+                    table.append((CPhaseGate(pi / float(2 ** (j + 1))), (n - (j + 1), n)))
+    else:
+        for n in range(0, size):
+            for j in range(0, n):
+                if limit is None or abs((n - j)) <= limit:
+                    table.append((CPhaseGate(-1 * pi / float(2 ** (n - j))), (j, n)))
+            table.append((HGate(), (n,)))
+    return tuple(table)
+
+
+def extendData(qc, instructions):
+    """
+    Appends instructions to a circuit without the checks and copies of QuantumCircuit.append. This relies on the
+    Qiskit internal QuantumCircuit._data (CircuitData in Qiskit 1.0), so every builder that writes instructions in bulk
+    goes through here and only this function needs revisiting when upgrading Qiskit. The parameter table is not
+    updated, so the operations must not hold Parameters.
+    :param qc: The quantum circuit being operated on
+    :param instructions: CircuitInstructions on the bits of qc, or a circuit over the same bits whose instructions are
+                         shared with qc without copying them
+    :return: None
+    """
+    if isinstance(instructions, QuantumCircuit):
+        instructions = instructions._data
+    qc._data.extend(instructions)
+
+
+def appendQFTTable(qc, reg, table):
+    """
+    Writes the gates of a qftTable onto reg. QuantumCircuits get the cached operations appended directly, anything
+    else that offers h and cp (BulkCircuit, ResourceCounter) is written into gate by gate.
+    :param qc: The quantum circuit being operated on
+    :param reg: The register the table is applied to
+    :param table: The result of qftTable for the length of reg
+    :return: None
+    """
+    if isinstance(qc, QuantumCircuit):
+        # None of the operations hold Parameters, so the parameter table does not need to be updated
+        extendData(qc, [CircuitInstruction(operation, tuple(reg[i] for i in indices), ())
+                        for operation, indices in table])
+        return
+    for operation, indices in table:
+        if len(indices) == 1:
+            qc.h(reg[indices[0]])
+        else:
+            qc.cp(operation.params[0], reg[indices[0]], reg[indices[1]])
+
+
+def qftCacheInfo():
+    """
+    :return: The hits, misses and size of the QFT table cache as a dict
+    """
+    info = qftTable.cache_info()
+    return {"hits": info.hits, "misses": info.misses, "size": info.currsize, "maxsize": info.maxsize}
+
+
+def clearQFTCache():
+    """
+    Empties the QFT table cache and resets its statistics.
+    :return: None
+    """
+    qftTable.cache_clear()
+
+
 def QFT(qc, reg):
     """
     Computes the quantum Fourier transform of reg, one qubit at
@@ -48,12 +147,19 @@ def QFT(qc, reg):
     :param reg: The register being changed to the phase basis
     :return: None
     """
-    for i in range(0, len(reg)):
-        n = len(reg) - 1 - i
+    appendQFTTable(qc, reg, qftTable(len(reg)))
 
-        qc.h(reg[n])
-        for j in range(0, n):
-            qc.cp(pi / float(2 ** (j + 1)), reg[n - (j + 1)], reg[n])
+
+def zeroQFT(qc, reg):
+    """
+    Computes the quantum Fourier transform of a register known to be |0...0>. Every controlled phase rotation of the
+    QFT has a control that is still |0> at that point, so only the Hadamard layer is applied.
+    :param qc: The quantum circuit being operated on
+    :param reg: The register being changed to the phase basis
+    :return: None
+    """
+    for i in range(0, len(reg)):
+        qc.h(reg[len(reg) - 1 - i])
 
 
 def invQFT(qc, reg):
@@ -65,10 +171,27 @@ def invQFT(qc, reg):
     :param qc: The quantum circuit being operated on
     :param reg: The register being changed out of the phase basis
     """
+    appendQFTTable(qc, reg, qftTable(len(reg), inverse=True))
+
+
+def semiclassicalInvQFT(qc, reg, creg, limit=None):
+    """
+    Performs the inverse (approximate) quantum Fourier transform on reg and measures it into creg, one qubit at a time
+    (Griffiths-Niu). Each controlled phase rotation of invQFT is replaced by a phase rotation conditioned on the
+    measured value of its control, so no two-qubit gates are needed. Requires a QuantumCircuit since it uses if_test.
+    :param qc: The quantum circuit being operated on
+    :param reg: The register being changed out of the phase basis
+    :param creg: The classical register reg is measured into, reg[n] into creg[n]
+    :param limit: The smallest acceptable phase shift to be performed, or None for the exact inverse QFT
+    :return: None
+    """
     for n in range(0, len(reg)):
         for j in range(0, n):
-            qc.cp(-1 * pi / float(2 ** (n - j)), reg[j], reg[n])
+            if limit is None or abs((n - j)) <= limit:
+                with qc.if_test((creg[j], 1)):
+                    qc.p(-1 * pi / float(2 ** (n - j)), reg[n])
         qc.h(reg[n])
+        qc.measure(reg[n], creg[n])
 
 
 def evolveQFTState(qc, reg_a, reg_b, n, factor):
@@ -76,12 +199,15 @@ def evolveQFTState(qc, reg_a, reg_b, n, factor):
     Evolves the state |F(ψ(reg_a))> to |F(ψ(reg_a+reg_b))> using the quantum
     Fourier transform conditioned on the qubits of the reg_b.
     Apply repeated phase rotations with parameters being pi divided by
-    increasing powers of two.
+    increasing powers of two. A factor of 2**k adds reg_b shifted left by k,
+    in which case the rotations that are multiples of 2*pi are left out.
     """
     len_b = len(reg_b)
     for i in range(0, n + 1):
         if (n - i) > len_b - 1:
             pass
+        elif (factor / float(2 ** i)) % 2 == 0:
+            pass
         else:
             qc.cp(factor * pi / float(2 ** i), reg_b[n - i], reg_a[n])
 
@@ -94,12 +220,7 @@ def AQFT(qc, reg, limit):
     :param reg:     The quantum register for the AQFT to be applied to.
     :param limit:   The smallest acceptable phase shift to be performed.
     """
-    for i in range(0, len(reg)):
-        n = len(reg) - 1 - i
-        qc.h(reg[n])
-        for j in range(0, n):
-            if abs((j + 1)) <= limit:
-                qc.cp(pi / float(2 ** (j + 1)), reg[n - (j + 1)], reg[n])
+    appendQFTTable(qc, reg, qftTable(len(reg), limit))
 
 
 def invAQFT(qc, reg, limit):
@@ -109,11 +230,7 @@ def invAQFT(qc, reg, limit):
     :param reg:     The quantum register for the AQFT to be applied to.
     :param limit:   The smallest acceptable phase shift to be performed.
     """
-    for n in range(0, len(reg)):
-        for j in range(0, n):
-            if abs((n - j)) <= limit:
-                qc.cp(-1 * pi / float(2 ** (n - j)), reg[j], reg[n])
-        qc.h(reg[n])
+    appendQFTTable(qc, reg, qftTable(len(reg), limit, inverse=True))
 
 
 def evolveAQFTState(qc, reg_a, reg_b, n, factor, limit):
@@ -121,12 +238,15 @@ def evolveAQFTState(qc, reg_a, reg_b, n, factor, limit):
     Evolves the state |F(ψ(reg_a))> to |F(ψ(reg_a+reg_b))> using the quantum
     Fourier transform conditioned on the qubits of the reg_b.
     Apply repeated phase rotations with parameters being pi divided by
-    increasing powers of two.
+    increasing powers of two. A factor of 2**k adds reg_b shifted left by k,
+    in which case the rotations that are multiples of 2*pi are left out.
     """
     len_b = len(reg_b)
     for i in range(0, n + 1):
         if (n - i) > len_b - 1:
             pass
+        elif (factor / float(2 ** i)) % 2 == 0:
+            pass
         else:
             if abs((2**i)/factor) <= 2**limit:
                 qc.cp(factor * pi / float(2 ** i), reg_b[n - i], reg_a[n])
@@ -134,97 +254,1508 @@ def evolveAQFTState(qc, reg_a, reg_b, n, factor, limit):
             #     # print("phase rot removed")
 
 
+# ----------------------Bulk Gate Emission---------------------------
+class BulkCircuit:
+    """
+    Stand-in for a QuantumCircuit that the circuit components (QFT, CCP, evolveQFTState, ...) can write into. The gates
+    are collected as arrays of opcodes, qubit indices and angles instead of being appended one at a time through the
+    QuantumCircuit API, and flush() materializes all of them into the wrapped circuit in one step. The resulting
+    circuit is identical to writing the same gates into the circuit directly.
+    """
+    X, H, P, CX, CP, MEASURE, BARRIER = range(7)
+
+    def __init__(self, qc):
+        """
+        :param qc: The circuit the collected gates will be appended to
+        """
+        self.qc = qc
+        self._qubitIndex = {bit: i for i, bit in enumerate(qc.qubits)}
+        self._clbitIndex = {bit: i for i, bit in enumerate(qc.clbits)}
+        self._labels = []
+        self._clear()
+
+    def _clear(self):
+        self.opcodes = array('b')
+        self.q0 = array('i')
+        self.q1 = array('i')
+        self.angles = array('d')
+
+    def __len__(self):
+        return len(self.opcodes)
+
+    def _add(self, opcode, q0, q1, angle):
+        self.opcodes.append(opcode)
+        self.q0.append(q0)
+        self.q1.append(q1)
+        self.angles.append(angle)
+
+    def _single(self, opcode, q, angle=0.0):
+        if isinstance(q, (QuantumRegister, list, tuple)):
+            for bit in q:
+                self._add(opcode, self._qubitIndex[bit], -1, angle)
+        else:
+            self._add(opcode, self._qubitIndex[q], -1, angle)
+
+    def x(self, q):
+        self._single(self.X, q)
+
+    def h(self, q):
+        self._single(self.H, q)
+
+    def p(self, theta, q):
+        self._single(self.P, q, theta)
+
+    def cx(self, c, t):
+        self._add(self.CX, self._qubitIndex[c], self._qubitIndex[t], 0.0)
+
+    def cp(self, theta, c, t):
+        self._add(self.CP, self._qubitIndex[c], self._qubitIndex[t], theta)
+
+    def measure(self, q, c):
+        if isinstance(q, (QuantumRegister, list, tuple)):
+            for qubit, clbit in zip(q, c):
+                self.measure(qubit, clbit)
+            return
+        self._add(self.MEASURE, self._qubitIndex[q], self._clbitIndex[c], 0.0)
+
+    def barrier(self, label=None):
+        self._labels.append(label)
+        self._add(self.BARRIER, len(self._labels) - 1, -1, 0.0)
+
+    def arrays(self):
+        """
+        :return: The collected opcodes, first indices, second indices and angles as NumPy arrays
+        """
+        return (np.frombuffer(self.opcodes, dtype=np.int8), np.frombuffer(self.q0, dtype=np.int32),
+                np.frombuffer(self.q1, dtype=np.int32), np.frombuffer(self.angles, dtype=np.float64))
+
+    def flush(self):
+        """
+        Appends every collected gate to the wrapped circuit and empties the buffers. Gates with the same opcode and
+        angle share one operation object.
+        :return: The wrapped circuit
+        """
+        opcodes, q0, q1, angles = self.arrays()
+        if len(opcodes) == 0:
+            return self.qc
+
+        keys = np.rec.fromarrays([opcodes, angles])
+        unique, inverse = np.unique(keys, return_inverse=True)
+        operations = [self._operation(int(opcode), float(angle)) for opcode, angle in unique]
+
+        qubits = self.qc.qubits
+        clbits = self.qc.clbits
+        allQubits = tuple(qubits)
+        instructions = []
+        for opcode, a, b, key in zip(opcodes.tolist(), q0.tolist(), q1.tolist(), inverse.tolist()):
+            if opcode <= self.P:
+                instructions.append(CircuitInstruction(operations[key], (qubits[a],), ()))
+            elif opcode <= self.CP:
+                instructions.append(CircuitInstruction(operations[key], (qubits[a], qubits[b]), ()))
+            elif opcode == self.MEASURE:
+                instructions.append(CircuitInstruction(operations[key], (qubits[a],), (clbits[b],)))
+            else:
+                barrier = Barrier(len(allQubits), label=self._labels[a])
+                instructions.append(CircuitInstruction(barrier, allQubits, ()))
+
+        # None of the operations hold Parameters, so the parameter table does not need to be updated
+        extendData(self.qc, instructions)
+        self._clear()
+        self._labels = []
+        return self.qc
+
+    def _operation(self, opcode, angle):
+        if opcode == self.X:
+            return XGate()
+        if opcode == self.H:
+            return HGate()
+        if opcode == self.P:
+            return PhaseGate(angle)
+        if opcode == self.CX:
+            return CXGate()
+        if opcode == self.CP:
+            return CPhaseGate(angle)
+        if opcode == self.MEASURE:
+            return Measure()
+        return None
+
+
+# ----------------------Native Basis Emission---------------------------
+# The basis gates of the simulated backends
+NATIVE_BASIS = ("rz", "sx", "x", "cx")
+
+
+class NativeCircuit:
+    """
+    Stand-in for a QuantumCircuit that the circuit components write into, like BulkCircuit, which emits every gate in
+    the rz/sx/x/cx basis of the simulated backends. Phase shifts are kept as a pending rotation per qubit and merged
+    until a gate that does not commute with them touches the qubit, and CCP is written as a phase polynomial with 6
+    cx instead of the 8 of its cp form. The global phase is kept in the circuit, so the unitary is unchanged. The
+    gates are appended as they are written, flush() writes out the pending rotations.
+    """
+
+    def __init__(self, qc):
+        """
+        :param qc: The circuit the gates are appended to
+        """
+        self.qc = qc
+        self._pending = {}
+        self._rotations = {}
+        self._phase = 0.0
+
+    def _append(self, operation, qubits, clbits=()):
+        extendData(self.qc, (CircuitInstruction(operation, qubits, clbits),))
+
+    def _rotate(self, q, theta):
+        self._pending[q] = self._pending.get(q, 0.0) + theta
+
+    def _settle(self, q):
+        # p(theta) = e^(i theta / 2) rz(theta) and p is 2 pi periodic
+        theta = (self._pending.pop(q, 0.0) + pi) % (2 * pi) - pi
+        if abs(theta) > 1e-12:
+            if theta not in self._rotations:
+                self._rotations[theta] = RZGate(theta)
+            self._append(self._rotations[theta], (q,))
+            self._phase += theta / 2
+
+    @staticmethod
+    def _bits(q):
+        return q if isinstance(q, (QuantumRegister, ClassicalRegister, list, tuple)) else (q,)
+
+    def x(self, q):
+        for bit in self._bits(q):
+            self._settle(bit)
+            self._append(XGate(), (bit,))
+
+    def h(self, q):
+        # h = e^(-i pi / 4) p(pi / 2) sx p(pi / 2)
+        for bit in self._bits(q):
+            self._rotate(bit, pi / 2)
+            self._settle(bit)
+            self._append(SXGate(), (bit,))
+            self._rotate(bit, pi / 2)
+            self._phase -= pi / 4
+
+    def p(self, theta, q):
+        for bit in self._bits(q):
+            self._rotate(bit, theta)
+
+    def cx(self, c, t):
+        # A rotation of the control commutes with the cx
+        self._settle(t)
+        self._append(CXGate(), (c, t))
+
+    def _parity(self, c, t, theta):
+        # Shifts the phase by theta when c xor t is 1, leaving t as it was
+        self.cx(c, t)
+        self._rotate(t, theta)
+        self.cx(c, t)
+
+    def cp(self, theta, c, t):
+        # theta c t = (theta / 2) (c + t - (c xor t))
+        self._rotate(c, theta / 2)
+        self._parity(c, t, -theta / 2)
+        self._rotate(t, theta / 2)
+
+    def ccp(self, theta, A, B, T):
+        """
+        Writes CCP(theta, A, B, T), which shifts the phase by 2 theta when all three qubits are 1. Expanding a b t
+        into parities gives (theta / 2) (a + b + t - (a xor b) - (a xor t) - (b xor t) + (a xor b xor t)), the parities
+        of T are walked in Gray code order so each one costs a single cx.
+        """
+        self.cx(A, T)
+        self._rotate(T, -theta / 2)
+        self.cx(B, T)
+        self._rotate(T, theta / 2)
+        self.cx(A, T)
+        self._rotate(T, -theta / 2)
+        self.cx(B, T)
+        self._parity(A, B, -theta / 2)
+        self._rotate(A, theta / 2)
+        self._rotate(B, theta / 2)
+        self._rotate(T, theta / 2)
+
+    def measure(self, q, c):
+        for qubit, clbit in zip(self._bits(q), self._bits(c)):
+            self._settle(qubit)
+            self._append(Measure(), (qubit,), (clbit,))
+
+    def barrier(self, label=None):
+        for q in list(self._pending):
+            self._settle(q)
+        self._append(Barrier(self.qc.num_qubits, label=label), tuple(self.qc.qubits))
+
+    def flush(self):
+        """
+        Writes out every pending rotation and adds the collected global phase to the wrapped circuit
+        :return: The wrapped circuit
+        """
+        for q in list(self._pending):
+            self._settle(q)
+        self.qc.global_phase += self._phase
+        self._phase = 0.0
+        return self.qc
+
+
+def isNativeBasis(qc):
+    """
+    :param qc: A quantum circuit
+    :return: Whether every gate of qc is in NATIVE_BASIS, so transpiling it only has to map it to the device
+    """
+    return all(name in NATIVE_BASIS or name in ("measure", "barrier") for name in qc.count_ops())
+
+
+# ----------------------Loop Folding---------------------------
+def repeatBody(qc, body, iterations, fold):
+    """
+    Repeats a loop body without writing its gates out again for every iteration. Aer runs the for_loop directly, while
+    the repeated instructions have to be expanded with qc.decompose("iteration") or transpile first.
+    :param qc: The quantum circuit being operated on
+    :param body: One iteration as a circuit over the qubits and clbits of qc, named "iteration"
+    :param iterations: The number of times to repeat the body
+    :param fold: "reference" to append the same instruction for every iteration, or "loop" to use a single for_loop
+    :return: None
+    """
+    if iterations == 0:
+        return
+    if fold == "loop":
+        qc.for_loop(range(iterations), None, body, qc.qubits, qc.clbits)
+    elif fold == "reference":
+        iteration = body.to_instruction()
+        for _ in range(iterations):
+            qc.append(iteration, qc.qubits, qc.clbits)
+    else:
+        raise ValueError("fold must be 'reference' or 'loop', not {}".format(fold))
+
+
+def foldedBlocks(qc):
+    """
+    Splits a circuit built with repeatBody into blocks that are each repeated a number of times. Runs of the same
+    iteration instruction and for_loop instructions become their body, everything else is kept in order.
+    :param qc: The circuit to split
+    :return: A list of (circuit, repetitions) pairs
+    """
+    blocks = []
+    segment = qc.copy_empty_like()
+    for instruction in qc.data:
+        operation = instruction.operation
+        if not isinstance(operation, ForLoopOp) and operation.name != "iteration":
+            segment.append(instruction)
+            continue
+
+        if len(segment.data):
+            blocks.append((segment, 1))
+            segment = qc.copy_empty_like()
+        if isinstance(operation, ForLoopOp):
+            blocks.append((operation.blocks[0], len(operation.params[0])))
+        elif blocks and blocks[-1][0] is operation.definition:
+            blocks[-1] = (operation.definition, blocks[-1][1] + 1)
+        else:
+            blocks.append((operation.definition, 1))
+    if len(segment.data):
+        blocks.append((segment, 1))
+    return blocks
+
+
+def foldedDepth(qc, decompositions=3):
+    """
+    Computes the depth of a circuit built with repeatBody by multiplying the depth of each body by its number of
+    iterations, so the unrolled circuit is never created. Blocks are treated as running one after another, which
+    matches the depth of the unrolled circuit except for the overlap between neighbouring iterations.
+    :param qc: The circuit to measure
+    :param decompositions: The number of times to decompose each block before measuring it
+    :return: The depth of the circuit
+    """
+    depth = 0
+    for block, repetitions in foldedBlocks(qc):
+        for _ in range(decompositions):
+            block = block.decompose()
+        depth += block.depth() * repetitions
+    return depth
+
+
+def foldedCountOps(qc, decompositions=3):
+    """
+    Counts the operations of a circuit built with repeatBody by multiplying the counts of each body by its number of
+    iterations, giving the same counts as the unrolled circuit.
+    :param qc: The circuit to count
+    :param decompositions: The number of times to decompose each block before counting it
+    :return: A Counter from operation name to the number of times it is applied
+    """
+    counts = Counter()
+    for block, repetitions in foldedBlocks(qc):
+        for _ in range(decompositions):
+            block = block.decompose()
+        for name, count in block.count_ops().items():
+            counts[name] += count * repetitions
+    return counts
+
+
+# ----------------------Stage Profiling---------------------------
+class StageProfiler:
+    """
+    Collects the wall time, the number of gates appended and the depth added by each stage of a circuit builder. The
+    create*Circuit functions take a profiler and call stage() at the points where readable=True places its barriers,
+    using the barrier labels as stage names. Without a profiler the only cost is one check per stage point.
+    Stages with the same name are accumulated, so repeated iterations add up to one entry. The depth is the one of the
+    circuit as built, where cp counts as a single gate, and is tracked incrementally so each gate is only looked at
+    once. Bulk builders are flushed at every stage point to see their gates, while the pending rotations of a
+    NativeCircuit count towards the stage that writes them out, so builders flush before closing their last stage.
+    """
+
+    def __init__(self):
+        self.stages = OrderedDict()
+        self._stage = None
+        self._start = None
+        self._qc = None
+        self._seen = 0
+        self._gates = 0
+        self._levels = {}
+        self._depth = 0
+
+    def _update(self, qc):
+        if qc is not self._qc:
+            self._qc = qc
+            self._seen = 0
+            self._gates = 0
+            self._levels = {}
+            self._depth = 0
+        for instruction in qc.data[self._seen:]:
+            if getattr(instruction.operation, "_directive", False):
+                continue
+            wires = instruction.qubits + instruction.clbits
+            level = max((self._levels.get(wire, 0) for wire in wires), default=0) + 1
+            for wire in wires:
+                self._levels[wire] = level
+            self._depth = max(self._depth, level)
+            self._gates += 1
+        self._seen = len(qc.data)
+
+    def stage(self, builder, name):
+        """
+        Closes the current stage and starts a new one
+        :param builder: The QuantumCircuit or BulkCircuit being built
+        :param name: The name of the stage being started, or None to only close the current stage
+        :return: None
+        """
+        now = time.perf_counter()
+        if isinstance(builder, BulkCircuit):
+            builder.flush()
+            builder = builder.qc
+        elif isinstance(builder, NativeCircuit):
+            builder = builder.qc
+        self._update(builder)
+        if self._stage is not None:
+            startTime, startGates, startDepth = self._start
+            totals = self.stages.setdefault(self._stage, {"time": 0.0, "gates": 0, "depth": 0, "count": 0})
+            totals["time"] += now - startTime
+            totals["gates"] += self._gates - startGates
+            totals["depth"] += self._depth - startDepth
+            totals["count"] += 1
+        self._stage = name
+        # Started after the bookkeeping so the time of the profiler itself is not counted
+        self._start = (time.perf_counter(), self._gates, self._depth)
+
+    def report(self):
+        """
+        Prints the totals of every stage to the console
+
+        :return: N/A
+        """
+        print("____________________________________")
+        for name, totals in self.stages.items():
+            print("{}: {:.4f}s, {} gates, depth {} ({} times)".format(name, totals["time"], totals["gates"],
+                                                                      totals["depth"], totals["count"]))
+        print("____________________________________")
+
+
+# ----------------------Gate Scheduling---------------------------
+def scheduleLayers(gates):
+    """
+    Packs commuting multiple controlled phase shifts into layers where no two gates share a qubit. Every CCP is
+    diagonal, so any order gives the same unitary. Gates are placed first fit, in the order they are given.
+    :param gates: An iterable of (phase, control 1, control 2, target) tuples
+    :return: A list of layers, each a list of (phase, control 1, control 2, target) tuples
+    """
+    layers = []
+    busy = {}  # qubit -> set of layer indices it is used in
+    for gate in gates:
+        qubits = gate[1:]
+        used = set()
+        for qubit in qubits:
+            used |= busy.setdefault(qubit, set())
+        layer = 0
+        while layer in used:
+            layer += 1
+        if layer == len(layers):
+            layers.append([])
+        layers[layer].append(gate)
+        for qubit in qubits:
+            busy[qubit].add(layer)
+    return layers
+
+
+# ----------------------Known State Simplification---------------------------
+_controlledPhases = {"cp", "cz", "cu1", "mcp", "ccz"}
+_controlledDiagonals = {"crz"}  # diagonal but not symmetric, only the control being |0> makes them the identity
+_diagonalSingles = {"p", "z", "s", "sdg", "t", "tdg", "rz", "u1"}
+_controlledSingles = {"cx", "cy", "ccx", "mcx"}
+
+
+def simplifyKnownStates(qc):
+    """
+    Removes gates that provably do nothing because of the computational basis states the qubits are known to be in.
+    Every qubit starts as |0> and stays known through X gates and diagonal gates; any other gate makes its qubits
+    unknown. Controlled gates with a control known to be |0> are dropped, as are phase gates on a qubit known to be
+    |0>. Control flow and custom instructions are kept and make their qubits unknown.
+    :param qc: The quantum circuit being simplified, which is not modified
+    :return: A new circuit with the same unitary on the initial state and the same measurement results
+    """
+    known = {qubit: 0 for qubit in qc.qubits}  # qubit -> 0 or 1, missing when unknown
+    kept = []
+    for instruction in qc.data:
+        operation = instruction.operation
+        name = operation.name
+        qubits = instruction.qubits
+        values = [known.get(qubit) for qubit in qubits]
+
+        if getattr(operation, "condition", None) is not None:
+            for qubit in qubits:
+                known.pop(qubit, None)
+        elif name in ("barrier", "measure"):
+            pass
+        elif name == "reset":
+            known[qubits[0]] = 0
+        elif name == "x":
+            if values[0] is not None:
+                known[qubits[0]] = 1 - values[0]
+        elif name in _diagonalSingles:
+            if values[0] == 0:
+                continue
+        elif name in _controlledPhases:
+            # A controlled phase is symmetric in its qubits, any of them being |0> makes it the identity
+            if 0 in values:
+                continue
+        elif name in _controlledDiagonals:
+            if values[0] == 0:
+                continue
+        elif name in _controlledSingles:
+            controls = values[:-1]
+            if 0 in controls:
+                continue
+            target = qubits[-1]
+            if all(value == 1 for value in controls) and values[-1] is not None:
+                known[target] = 1 - values[-1]
+            else:
+                known.pop(target, None)
+        else:
+            for qubit in qubits:
+                known.pop(qubit, None)
+        kept.append(instruction)
+
+    simplified = qc.copy_empty_like()
+    if qc.parameters:
+        for instruction in kept:
+            simplified.append(instruction)
+    else:
+        extendData(simplified, kept)
+    return simplified
+
+
+# ----------------------Circuit Templates---------------------------
+# Operand-independent circuits keyed by their shape, see getTemplate. The least recently used templates are dropped
+# once more than TEMPLATE_CACHE_SIZE are held.
+TEMPLATE_CACHE_SIZE = 256
+_templateCache = OrderedDict()
+
+
+def getTemplate(key, build):
+    """
+    Returns the operand-independent circuit stored under key, building it on the first request only
+    :param key: A hashable description of the circuit shape ie) ("QAM", len1, len2, readable)
+    :param build: A function with no arguments that returns the template circuit for key
+    :return: The cached template, which is shared between calls and must be treated as read-only
+    """
+    template = _templateCache.get(key)
+    if template is None:
+        template = build()
+        _templateCache[key] = template
+        if len(_templateCache) > TEMPLATE_CACHE_SIZE:
+            _templateCache.popitem(last=False)
+    else:
+        _templateCache.move_to_end(key)
+    return template
+
+
+def instantiateTemplate(template, inputs):
+    """
+    Creates a circuit for a specific set of inputs by adding the initialization prefix in front of a template. Only
+    the X gates of the prefix are appended one by one, the template body is shared with the cached template.
+    :param template: The operand-independent circuit returned by getTemplate
+    :param inputs: The binary strings for the first registers of the template, in register order
+    :return: A new circuit equal to building the same circuit from scratch with the given inputs
+    """
+    qc = template.copy_empty_like()
+    for reg, num in zip(qc.qregs, inputs):
+        initializeQReg(qc, reg, num)
+    # Shares the template instructions without copying them
+    extendData(qc, template)
+    return qc
+
+
+def clearTemplates():
+    """
+    Removes every cached template, releasing the memory held by them
+    :return: None
+    """
+    _templateCache.clear()
+
+
 # ----------------------Simulator Code---------------------------
-def runIdeal(qc, answer, bits, printAll=False):
+def genericBackend(qc, seed=None):
     """
-    Runs the provided circuit with 1024 shots without noise
+    Creates the generic backend used for the noisy simulations, with control flow support if qc needs it
     :param qc: The pre-created quantum circuit to be run
+    :param seed: The seed for the randomly generated backend properties, or None
+    :return: A GenericBackendV2 with as many qubits as qc
+    """
+    return GenericBackendV2(num_qubits=qc.num_qubits, control_flow=hasControlFlow(qc), seed=seed)
+
+
+@lru_cache(maxsize=None)
+def aerBasisGates(method="automatic"):
+    """
+    :param method: An Aer simulation method
+    :return: The names of the instructions AerSimulator runs directly with that method, as a frozenset
+    """
+    return frozenset(AerSimulator(method=method).configuration().basis_gates)
+
+
+def hasControlFlow(qc):
+    """
+    :param qc: A quantum circuit
+    :return: Whether qc uses control flow (for_loop, if_test, ...)
+    """
+    return any(isinstance(instruction.operation, ControlFlowOp) for instruction in qc.data)
+
+
+def circuitKey(qc):
+    """
+    Hashes the structure of a circuit: its size, classical register sizes, global phase and every instruction with its
+    parameters, qubit and clbit indices and condition. Circuits built the same way get the same key even though their
+    bit and register objects (and auto-generated register names) differ.
+    :param qc: A quantum circuit
+    :return: A hex digest
+    """
+    digest = hashlib.sha256()
+    _hashCircuit(qc, digest)
+    return digest.hexdigest()
+
+
+def _hashCircuit(qc, digest):
+    digest.update(repr((qc.num_qubits, qc.num_clbits, [creg.size for creg in qc.cregs],
+                        float(qc.global_phase))).encode())
+    qubitIndex = {bit: i for i, bit in enumerate(qc.qubits)}
+    clbitIndex = {bit: i for i, bit in enumerate(qc.clbits)}
+    cregIndex = {creg: i for i, creg in enumerate(qc.cregs)}
+    for instruction in qc.data:
+        operation = instruction.operation
+        params = []
+        for param in operation.params:
+            if isinstance(param, QuantumCircuit):
+                _hashCircuit(param, digest)
+                params.append("block")
+            else:
+                params.append(param)
+        condition = getattr(operation, "condition", None)
+        if condition is not None:
+            target = condition[0]
+            condition = (clbitIndex[target] if target in clbitIndex else ("creg", cregIndex.get(target)), condition[1])
+        digest.update(repr((operation.name, params, [qubitIndex[bit] for bit in instruction.qubits],
+                            [clbitIndex[bit] for bit in instruction.clbits], condition)).encode())
+
+
+def backendKey(backend):
+    """
+    Hashes the target of a backend: its qubit count and the error and duration of every instruction on every qubit.
+    :param backend: A BackendV2
+    :return: A hex digest
+    """
+    target = backend.target
+    digest = hashlib.sha256(repr((backend.name, target.num_qubits)).encode())
+    for name in sorted(target.operation_names):
+        properties = target[name]
+        for qargs in sorted(properties, key=repr):
+            prop = properties[qargs]
+            digest.update(repr((name, qargs, None if prop is None else (prop.error, prop.duration))).encode())
+    return digest.hexdigest()
+
+
+def printAnswer(counts, answer, bits, printAll=False, label="ideal"):
+    """
+    Prints how often the expected answer was measured
+    :param counts: The counts of a simulation
     :param answer: The expected answer for the multiplication
     :param bits: how many bits there will be in the output
     :param printAll: Whether to print all the counts or just those for the answer
-    :return: The results of the simulation
+    :param label: The name printed with all the counts
+    :return: None
     """
-    # Construct an ideal simulator (Use GPU line if Aer is installed with GPU support)
-    aersim = AerSimulator()
-    # aersim = AerSimulator(device="GPU")
-    # Perform an ideal simulation
-    result_ideal = aersim.run(qc).result()
-    counts_ideal = result_ideal.get_counts(0)
     if printAll:
-        print('Counts(ideal):', counts_ideal)
+        print('Counts({}):'.format(label), counts)
     key = bin(answer).lstrip('0b').zfill(bits)
-    if key in counts_ideal:
-        print(key, ": ", counts_ideal[key])
+    if key in counts:
+        print(key, ": ", counts[key])
     else:
         print("key, ", key, ", not present in results")
 
-    return result_ideal
 
+_cliffordGates = {"x", "y", "z", "h", "s", "sdg", "sx", "sxdg", "cx", "cy", "cz", "swap", "measure", "barrier",
+                  "reset", "id", "delay"}
+_phaseGates = {"p": pi / 2, "u1": pi / 2, "rz": pi / 2, "cp": pi, "cu1": pi, "crz": pi}
+# Aer methods that save exact probabilities, the extended stabilizer method only samples
+_exactProbabilityMethods = {"statevector", "density_matrix", "stabilizer", "matrix_product_state"}
 
-def runNoisy(qc, answer, bits, printAll=False):
+
+def countNonClifford(qc):
+    """
+    Counts the gates of a circuit that are not Clifford gates, looking into gate definitions and loop bodies. Phase
+    gates are Clifford when their angle is a multiple of pi/2 (pi for controlled phases).
+    :param qc: A quantum circuit
+    :return: The number of non-Clifford gates
+    """
+    count = 0
+    for instruction in qc.data:
+        operation = instruction.operation
+        name = operation.name
+        if name in _cliffordGates:
+            continue
+        if name in _phaseGates:
+            turns = float(operation.params[0]) / _phaseGates[name]
+            count += 0 if abs(turns - round(turns)) < 1e-9 else 1
+        elif isinstance(operation, ForLoopOp):
+            count += len(operation.params[0]) * countNonClifford(operation.params[2])
+        elif isinstance(operation, ControlFlowOp):
+            count += sum(countNonClifford(block) for block in operation.blocks)
+        elif operation.definition is not None:
+            count += countNonClifford(operation.definition)
+        else:
+            count += 1
+    return count
+
+
+def estimateMemory(qc):
+    """
+    Estimates the memory that simulating a circuit takes with the different Aer methods
+    :param qc: A quantum circuit
+    :return: A dict with the qubit count, the number of non-Clifford gates and the bytes needed for a statevector
+             ("statevector") and a density matrix ("density_matrix") of complex doubles
+    """
+    return {"qubits": qc.num_qubits, "nonClifford": countNonClifford(qc), "statevector": 16 * 2 ** qc.num_qubits,
+            "density_matrix": 16 * 4 ** qc.num_qubits}
+
+
+def availableMemory():
+    """
+    :return: Half of the physical memory of the machine in bytes, used when no memory limit is configured
+    """
+    return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") // 2
+
+
+def chooseMethod(qc, memoryLimit=None, maxNonClifford=16, allowMPS=False, allowExtendedStabilizer=False):
+    """
+    Picks the Aer simulation method for a circuit. A statevector is used when it fits in the memory limit; above that
+    Clifford circuits use the stabilizer method. Circuits with few non-Clifford gates use the extended stabilizer
+    method when allowExtendedStabilizer is set, which only approximates the output and cannot save probabilities.
+    Anything else is refused unless allowMPS is set, in which case the matrix product state method is used, which
+    stays small for the multipliers since their operand registers are basis states and the product register is only
+    phase-shifted between the (A)QFTs.
+    :param qc: The pre-created quantum circuit to be run
+    :param memoryLimit: The number of bytes the statevector may use, or None for half of the physical memory
+    :param maxNonClifford: The highest number of non-Clifford gates the extended stabilizer method is used for
+    :param allowMPS: Whether the matrix product state method may be chosen
+    :param allowExtendedStabilizer: Whether the extended stabilizer method may be chosen
+    :return: The name of the method
+    :raises MemoryError: When no method can run the circuit within the memory limit
+    """
+    if memoryLimit is None:
+        memoryLimit = availableMemory()
+    if 16 * 2 ** qc.num_qubits <= memoryLimit:
+        return "statevector"
+    nonClifford = countNonClifford(qc)
+    if nonClifford == 0:
+        return "stabilizer"
+    if allowExtendedStabilizer and nonClifford <= maxNonClifford:
+        return "extended_stabilizer"
+    if allowMPS:
+        return "matrix_product_state"
+    raise MemoryError("A statevector of {} qubits needs {:.3g} GB but the limit is {:.3g} GB, and the circuit has {} "
+                      "non-Clifford gates".format(qc.num_qubits, 16 * 2 ** qc.num_qubits / 1e9, memoryLimit / 1e9,
+                                                  nonClifford))
+
+
+def simulationOptions(qc, memoryLimit=None, maxNonClifford=16, allowMPS=False, truncateMPS=False,
+                      allowExtendedStabilizer=False):
+    """
+    Picks the Aer run options for a circuit with the method of chooseMethod. Matrix product states are exact unless
+    truncateMPS is set, which caps the bond dimension so the tensors fit in the memory limit. Truncated results are
+    approximate, so a warning is issued every time they are chosen. Aer's own memory check is left in place for every
+    other method. For matrix product states it assumes the worst case bond dimension (4 TB for 32 qubits) whatever the
+    cap, which refuses every circuit the method is chosen for, so it is only lifted once allowMPS opted into them.
+    :param qc: The pre-created quantum circuit to be run
+    :param memoryLimit: The number of bytes the simulation may use, or None for half of the physical memory
+    :param maxNonClifford: The highest number of non-Clifford gates the extended stabilizer method is used for
+    :param allowMPS: Whether the matrix product state method may be chosen
+    :param truncateMPS: Whether matrix product states may be truncated to the memory limit
+    :param allowExtendedStabilizer: Whether the extended stabilizer method may be chosen
+    :return: A dict of options for AerSimulator.run
+    :raises MemoryError: When no method can run the circuit within the memory limit
+    """
+    if memoryLimit is None:
+        memoryLimit = availableMemory()
+    method = chooseMethod(qc, memoryLimit, maxNonClifford, allowMPS, allowExtendedStabilizer)
+    if method != "matrix_product_state":
+        return {"method": method}
+    if not truncateMPS:
+        return {"method": method, "max_memory_mb": 2 ** 40}
+    # Each of the qubits holds two bond x bond matrices of complex doubles
+    bond = int(sqrt(memoryLimit / (qc.num_qubits * 2 * 16)))
+    warnings.warn("Simulating {} qubits as a matrix product state truncated to bond dimension {}, the results are "
+                  "approximate".format(qc.num_qubits, bond), RuntimeWarning, stacklevel=2)
+    return {"method": method, "matrix_product_state_max_bond_dimension": bond, "max_memory_mb": 2 ** 40}
+
+
+def finalMeasurements(qc):
+    """
+    Finds the measurements that could be moved to the end of the circuit: the last measurement into each clbit whose
+    qubit and clbit no later instruction (other than a barrier) uses. Transpiled circuits interleave these with the
+    gates on other qubits.
+    :param qc: A quantum circuit
+    :return: A dict of position in qc.data -> instruction of those measurements
+    """
+    final = {}
+    touchedQubits = set()
+    touchedClbits = set()
+    for position in range(len(qc.data) - 1, -1, -1):
+        instruction = qc.data[position]
+        if instruction.operation.name == "barrier":
+            continue
+        if instruction.operation.name == "measure" and instruction.qubits[0] not in touchedQubits \
+                and instruction.clbits[0] not in touchedClbits:
+            final[position] = instruction
+        touchedQubits.update(instruction.qubits)
+        touchedClbits.update(instruction.clbits)
+    return final
+
+
+def saveFinalProbabilities(qc, bits):
+    """
+    Replaces the final measurements of a circuit by saving the probabilities of the measured qubits under the label
+    "probabilities", ordered by the clbits they were measured into so the saved index is the measured value
+    :param qc: A quantum circuit whose output is measured at the end
+    :param bits: how many bits there will be in the output, the clbits 0 to bits - 1
+    :return: The new circuit and the list of measured qubits, the one measured into clbit 0 first
+    :raises ValueError: When one of the clbits is not measured at the end of the circuit
+    """
+    final = finalMeasurements(qc)
+    measured = {instruction.clbits[0]: instruction.qubits[0] for instruction in final.values()}
+    missing = [i for i in range(bits) if qc.clbits[i] not in measured]
+    if missing:
+        raise ValueError("The clbits {} are not measured at the end of the circuit".format(missing))
+
+    qubits = [measured[qc.clbits[i]] for i in range(bits)]
+    stripped = qc.copy_empty_like()
+    for position, instruction in enumerate(qc.data):
+        if position not in final:
+            stripped.append(instruction)
+    stripped.save_probabilities(qubits, label="probabilities")
+    return stripped, qubits
+
+
+# ----------------------Noise Sweeps---------------------------
+# One point of a noise sweep: depolarizing probabilities of single qubit gates and cx gates, a symmetric readout error
+# and, when t1 is set, thermal relaxation over the given gate times (t2 defaults to t1). Times are in seconds.
+NoiseConfig = namedtuple("NoiseConfig", ["prob_1", "prob_2", "readout", "t1", "t2", "gateTime1", "gateTime2"],
+                         defaults=[0.0, 0.0, 0.0, None, None, 5e-8, 3e-7])
+
+
+def configErrors(config):
+    """
+    :param config: A NoiseConfig
+    :return: The QuantumErrors of its rz gates, its sx and x gates and its cx gates. rz is virtual and only gets the
+             depolarizing error.
+    """
+    error_rz = noise.depolarizing_error(config.prob_1, 1)
+    error_1 = error_rz
+    error_2 = noise.depolarizing_error(config.prob_2, 2)
+    if config.t1 is not None:
+        t2 = config.t1 if config.t2 is None else config.t2
+        error_1 = error_1.compose(noise.thermal_relaxation_error(config.t1, t2, config.gateTime1))
+        relax_2 = noise.thermal_relaxation_error(config.t1, t2, config.gateTime2)
+        error_2 = error_2.compose(relax_2.expand(relax_2))
+    return error_rz, error_1, error_2
+
+
+@lru_cache(maxsize=None)
+def noiseModel(config):
+    """
+    Builds the noise model of a NoiseConfig on the rz, sx, x and cx basis. The result is cached, so every sweep using
+    the same configuration shares one model.
+    :param config: A NoiseConfig
+    :return: The NoiseModel, which is shared and must not be modified
+    """
+    noise_model = NoiseModel()
+    error_rz, error_1, error_2 = configErrors(config)
+    noise_model.add_all_qubit_quantum_error(error_rz, ['rz'])
+    noise_model.add_all_qubit_quantum_error(error_1, ['sx', 'x'])
+    noise_model.add_all_qubit_quantum_error(error_2, ['cx'])
+    if config.readout:
+        noise_model.add_all_qubit_readout_error(noise.ReadoutError([[1 - config.readout, config.readout],
+                                                                    [config.readout, 1 - config.readout]]))
+    return noise_model
+
+
+def insertReadout(qc, readout):
+    """
+    Adds a symmetric readout error to the final measurements of a circuit as a bit flip channel in front of them, which
+    gives the same measured distribution as a readout error on the measurement itself
+    :param qc: A quantum circuit whose output is measured at the end
+    :param readout: The probability of reading a qubit wrong
+    :return: A new circuit, or qc itself when readout is 0
+    """
+    if not readout:
+        return qc
+    final = finalMeasurements(qc)
+    flip = noise.pauli_error([("X", readout), ("I", 1 - readout)]).to_instruction()
+    noisy = qc.copy_empty_like()
+    for position, instruction in enumerate(qc.data):
+        if position in final:
+            noisy.append(flip, instruction.qubits)
+        noisy.append(instruction)
+    return noisy
+
+
+def noisyCircuit(qc, config):
+    """
+    :param qc: A circuit transpiled to the rz, sx, x and cx basis
+    :param config: A NoiseConfig
+    :return: A copy of qc with the errors of the configuration inserted as quantum channels, so it can be run on an
+             ideal simulator together with circuits of other configurations
+    """
+    return insertReadout(insert_noise(qc, noiseModel(config)), config.readout)
+
+
+# ----------------------Success Estimation---------------------------
+@lru_cache(maxsize=None)
+def configFidelities(config):
+    """
+    :param config: A NoiseConfig
+    :return: A dict of gate name -> process fidelity of its error, the probability that the gate runs without error
+    """
+    error_rz, error_1, error_2 = configErrors(config)
+    return {"rz": process_fidelity(error_rz.to_quantumchannel()), "sx": process_fidelity(error_1.to_quantumchannel()),
+            "x": process_fidelity(error_1.to_quantumchannel()), "cx": process_fidelity(error_2.to_quantumchannel()),
+            "measure": 1 - config.readout}
+
+
+def backendFidelities(backend):
+    """
+    Builds the gate and readout errors of a backend the same way NoiseModel.from_backend does and takes the process
+    fidelity of every gate error and the average correct readout probability of every qubit
+    :param backend: A BackendV2 such as the GenericBackendV2 of runNoisy
+    :return: A dict of (gate name, qubit indices) -> fidelity
+    """
+    fidelities = {}
+    for name, qubits, error in basic_device_gate_errors(target=backend.target):
+        fidelities[(name, tuple(qubits))] = process_fidelity(error.to_quantumchannel())
+    for qubits, error in basic_device_readout_errors(target=backend.target):
+        fidelities[("measure", tuple(qubits))] = float(np.mean(np.diag(error.probabilities)))
+    return fidelities
+
+
+def estimateSuccess(qc, fidelities, bits, scale=1.0):
     """
-    Runs the provided circuit with 1024 shots and noise
+    Predicts the probability of measuring the right answer as the probability that no instruction fails, the product
+    of their fidelities F, raised to a calibrated scale. A failed run is assumed to give a uniformly random output:
+    P = F^scale + (1 - F^scale) / 2^bits
+    :param qc: A circuit transpiled to the basis of the fidelities
+    :param fidelities: A dict from configFidelities or backendFidelities
+    :param bits: how many bits there will be in the output
+    :param scale: The exponent fitted by SimulationSession.calibrateEstimator
+    :return: The predicted probability
+    """
+    logFidelity = 0.0
+    for instruction in qc.data:
+        name = instruction.operation.name
+        qargs = tuple(qc.find_bit(q).index for q in instruction.qubits)
+        fidelity = fidelities.get((name, qargs), fidelities.get(name, 1.0))
+        if fidelity <= 0:
+            return 2.0 ** -bits
+        logFidelity += np.log(fidelity)
+    survival = np.exp(scale * logFidelity)
+    return float(survival + (1 - survival) * 2.0 ** -bits)
+
+
+class SimulationSession:
+    """
+    Holds the simulators, generic backends and noise models used by runIdeal, runNoisy and runLessNoisy so they are
+    created once and reused by every run instead of being rebuilt on every call. Backends are cached by qubit count
+    (and control flow support), noise simulators by their error probabilities. Since a backend is only generated once,
+    every noisy run on the same number of qubits within a session sees the same backend properties.
+
+    Transpiled circuits are cached as well, keyed by circuitKey, backendKey and the transpiler settings, in memory and
+    optionally as QPY files in cacheDir. A repeated run of the same (or an identically built) circuit reuses the
+    transpiled circuit of the first run instead of transpiling it again.
+
+    Every run picks its simulation method with simulationOptions before transpiling, so circuits too large for a
+    statevector in memoryLimit run with a cheaper method or are refused with a MemoryError before any work is done.
+    The approximate methods are only used when opted into: truncated matrix product states with truncateMPS and the
+    extended stabilizer with allowExtendedStabilizer. exactSuccessProbability refuses both.
+    """
+
+    def __init__(self, seed=None, cacheDir=None, transpileCacheSize=32, seed_transpiler=None, memoryLimit=None,
+                 maxNonClifford=16, allowMPS=False, densityMatrixQubits=10, truncateMPS=False,
+                 allowExtendedStabilizer=False):
+        """
+        :param seed: The seed for the generated backend properties, or None for random properties
+        :param cacheDir: A directory to persist transpiled circuits in, or None to only cache them in memory
+        :param transpileCacheSize: The number of transpiled circuits kept in memory
+        :param seed_transpiler: The seed passed on to transpile
+        :param memoryLimit: The number of bytes a statevector may use, or None for half of the physical memory
+        :param maxNonClifford: The highest number of non-Clifford gates the extended stabilizer method is used for
+        :param allowMPS: Whether circuits that are too large for a statevector may use the matrix product state method
+        :param truncateMPS: Whether matrix product states may be truncated to memoryLimit, which makes the results
+                            approximate and warns every time
+        :param densityMatrixQubits: The largest circuit noisySuccessProbability computes exactly with a density matrix
+        :param allowExtendedStabilizer: Whether circuits that are too large for a statevector and have at most
+                                        maxNonClifford non-Clifford gates may use the approximate extended stabilizer
+                                        method
+        """
+        self.seed = seed
+        self.memoryLimit = memoryLimit
+        self.maxNonClifford = maxNonClifford
+        self.allowMPS = allowMPS
+        self.truncateMPS = truncateMPS
+        self.allowExtendedStabilizer = allowExtendedStabilizer
+        self.densityMatrixQubits = densityMatrixQubits
+        self.estimatorScale = 1.0
+        self.cacheDir = cacheDir
+        self.transpileCacheSize = transpileCacheSize
+        self.seed_transpiler = seed_transpiler
+        self._idealSimulator = None
+        self._backends = {}
+        self._backendKeys = {}
+        self._noiseSimulators = {}
+        self._densitySimulators = {}
+        self._fidelities = {}
+        self._transpiled = OrderedDict()
+        self.transpileHits = 0
+        self.transpileDiskHits = 0
+        self.transpileMisses = 0
+
+    def idealSimulator(self):
+        """
+        :return: The shared AerSimulator without noise
+        """
+        if self._idealSimulator is None:
+            # Construct an ideal simulator (Use GPU line if Aer is installed with GPU support)
+            self._idealSimulator = AerSimulator()
+            # self._idealSimulator = AerSimulator(device="GPU")
+        return self._idealSimulator
+
+    def options(self, qc):
+        """
+        :param qc: The circuit to be run
+        :return: The Aer run options simulationOptions picks with the limits of this session
+        """
+        return simulationOptions(qc, self.memoryLimit, self.maxNonClifford, self.allowMPS, self.truncateMPS,
+                                 self.allowExtendedStabilizer)
+
+    def idealCircuit(self, qc, method="automatic"):
+        """
+        Unrolls the instructions the simulation method does not know (like the library gate of the QFM, or mcphase for
+        matrix product states) to its basis gates at optimization level 0, leaving every other gate as built. No target
+        is used, since the one of AerSimulator caps the width at the qubits a statevector fits in and would refuse the
+        circuits run with other methods.
+        :param qc: The pre-created quantum circuit to be run
+        :param method: The Aer simulation method the circuit is run with, picked by options
+        :return: qc itself when the method knows every instruction, or else the transpiled circuit, which is shared and
+                 must not be modified
+        """
+        basis = aerBasisGates(method)
+        if not hasControlFlow(qc) and all(name in basis or name in ("measure", "barrier") for name in qc.count_ops()):
+            return qc
+        return self.transpile(qc, method, optimization_level=0)
+
+    def backend(self, qc):
+        """
+        :param qc: The pre-created quantum circuit to be run
+        :return: The shared generic backend for the qubit count of qc
+        """
+        key = (qc.num_qubits, hasControlFlow(qc))
+        if key not in self._backends:
+            self._backends[key] = genericBackend(qc, self.seed)
+        return self._backends[key]
+
+    def noiseSimulator(self, prob_1=0.00001, prob_2=0.0001):
+        """
+        :param prob_1: The depolarizing error probability of single qubit gates
+        :param prob_2: The depolarizing error probability of cx gates
+        :return: The shared AerSimulator with only gate noise ie) no decoherence or readout noise
+        """
+        key = (prob_1, prob_2)
+        if key not in self._noiseSimulators:
+            noise_model = NoiseModel()
+            error_1 = noise.depolarizing_error(prob_1, 1)
+            error_2 = noise.depolarizing_error(prob_2, 2)
+            noise_model.add_all_qubit_quantum_error(error_1, ['rz', 'sx', 'x'])
+            noise_model.add_all_qubit_quantum_error(error_2, ['cx'])
+            self._noiseSimulators[key] = AerSimulator(noise_model=noise_model)
+        return self._noiseSimulators[key]
+
+    def transpile(self, qc, backend, optimization_level=None):
+        """
+        Transpiles qc for backend, reusing an earlier result for the same circuit structure, target and settings
+        :param qc: The pre-created quantum circuit to be run
+        :param backend: The backend the circuit is transpiled for, or the name of an Aer simulation method to only
+                        unroll it to the aerBasisGates of that method
+        :param optimization_level: The optimization level passed on to transpile. By default circuits that are already
+                                   in the NATIVE_BASIS are only laid out and routed, at level 0.
+        :return: The transpiled circuit, which is shared and must not be modified
+        """
+        if isinstance(backend, str):
+            target = ("aerBasisGates", backend)
+        else:
+            if id(backend) not in self._backendKeys:
+                self._backendKeys[id(backend)] = (backend, backendKey(backend))
+            target = self._backendKeys[id(backend)][1]
+        settings = (optimization_level, self.seed_transpiler)
+        key = hashlib.sha256(repr((circuitKey(qc), target, settings)).encode()).hexdigest()
+
+        if key in self._transpiled:
+            self.transpileHits += 1
+            self._transpiled.move_to_end(key)
+            return self._transpiled[key]
+
+        path = None if self.cacheDir is None else os.path.join(self.cacheDir, key + ".qpy")
+        if path is not None and os.path.exists(path):
+            self.transpileDiskHits += 1
+            with open(path, "rb") as file:
+                transpiled_circuit = qpy.load(file)[0]
+        else:
+            self.transpileMisses += 1
+            level = optimization_level
+            if level is None and isNativeBasis(qc):
+                level = 0
+            if isinstance(backend, str):
+                transpiled_circuit = transpile(qc, basis_gates=sorted(aerBasisGates(backend)), optimization_level=level,
+                                               seed_transpiler=self.seed_transpiler)
+            else:
+                transpiled_circuit = transpile(qc, backend, optimization_level=level,
+                                               seed_transpiler=self.seed_transpiler)
+            if path is not None:
+                os.makedirs(self.cacheDir, exist_ok=True)
+                with open(path, "wb") as file:
+                    qpy.dump(transpiled_circuit, file)
+
+        self._transpiled[key] = transpiled_circuit
+        if len(self._transpiled) > self.transpileCacheSize:
+            self._transpiled.popitem(last=False)
+        return transpiled_circuit
+
+    def transpileCacheInfo(self):
+        """
+        :return: The hits (in memory and on disk), misses and size of the transpile cache as a dict
+        """
+        return {"hits": self.transpileHits, "diskHits": self.transpileDiskHits, "misses": self.transpileMisses,
+                "size": len(self._transpiled), "maxsize": self.transpileCacheSize}
+
+    def clear(self):
+        """
+        Drops every cached simulator, backend and transpiled circuit held in memory.
+        :return: None
+        """
+        self._idealSimulator = None
+        self._backends = {}
+        self._backendKeys = {}
+        self._noiseSimulators = {}
+        self._densitySimulators = {}
+        self._fidelities = {}
+        self._transpiled = OrderedDict()
+
+    def runIdeal(self, qc, answer, bits, printAll=False):
+        """
+        Runs the provided circuit with 1024 shots without noise
+        :param qc: The pre-created quantum circuit to be run
+        :param answer: The expected answer for the multiplication
+        :param bits: how many bits there will be in the output
+        :param printAll: Whether to print all the counts or just those for the answer
+        :return: The results of the simulation
+        """
+        # Perform an ideal simulation
+        options = self.options(qc)
+        circuit = self.idealCircuit(qc, options["method"])
+        result_ideal = self.idealSimulator().run(circuit, **options).result()
+        printAnswer(result_ideal.get_counts(0), answer, bits, printAll, "ideal")
+        return result_ideal
+
+    def runNoisy(self, qc, answer, bits, printAll=False):
+        """
+        Runs the provided circuit with 1024 shots and the noise of a generic backend
+        :param qc: The pre-created quantum circuit to be run
+        :param answer: The expected answer for the multiplication
+        :param bits: how many bits there will be in the output
+        :param printAll: Whether to print all the counts or just those for the answer
+        :return: The results of the simulation
+        """
+        # Refuse circuits that cannot be simulated before transpiling them
+        self.options(qc)
+        backend = self.backend(qc)
+        transpiled_circuit = self.transpile(qc, backend)
+
+        # Perform noisy simulation (Use GPU line if Aer is installed with GPU support) (blocking_qubits=??)
+        result_noise = backend.run(transpiled_circuit, **self.options(transpiled_circuit)).result()
+        # result_noise = backend.run(transpiled_circuit, device="GPU", blocking_enable=True).result()
+        printAnswer(result_noise.get_counts(0), answer, bits, printAll, "noise")
+        return result_noise
+
+    def runLessNoisy(self, qc, answer, bits, printAll=False, prob_1=0.00001, prob_2=0.0001):
+        """
+        Runs the provided circuit with 1024 shots and less noise than the previous noise run
+        :param qc: The pre-created quantum circuit to be run
+        :param answer: The expected answer for the multiplication
+        :param bits: how many bits there will be in the output
+        :param printAll: Whether to print all the counts or just those for the answer
+        :param prob_1: The depolarizing error probability of single qubit gates
+        :param prob_2: The depolarizing error probability of cx gates
+        :return: The results of the simulation
+        """
+        self.options(qc)
+        sim = self.noiseSimulator(prob_1, prob_2)
+
+        # Perform noisy simulation (Use GPU line if Aer is installed with GPU support) (blocking_qubits=??)
+        transpiled_circuit = self.transpile(qc, self.backend(qc))
+        result = sim.run(transpiled_circuit, **self.options(transpiled_circuit)).result()
+        # result = sim.run(transpiled_circuit, device="GPU", blocking_enable=True).result()
+        printAnswer(result.get_counts(0), answer, bits, printAll, "noise")
+        return result
+
+    def exactSuccessProbability(self, qc, answer, bits):
+        """
+        Computes the exact output distribution of an ideal run instead of sampling shots. The final measurements are
+        replaced by saving the probabilities of the measured qubits, ordered by the clbits they were measured into.
+        Measurements earlier in the circuit are still sampled, once.
+        :param qc: The pre-created quantum circuit to be run
+        :param answer: The expected answer for the multiplication
+        :param bits: how many bits there will be in the output, the clbits 0 to bits - 1
+        :return: The probability of measuring the answer and a NumPy array of the probability of every output value
+        :raises MemoryError: When the circuit only fits in memory with a method that does not give exact probabilities
+        """
+        options = self.options(qc)
+        if options["method"] not in _exactProbabilityMethods or "matrix_product_state_max_bond_dimension" in options:
+            raise MemoryError("{} qubits only fit in the memory limit with an approximate {} simulation, which does "
+                              "not give exact probabilities".format(qc.num_qubits, options["method"]))
+        stripped, qubits = saveFinalProbabilities(self.idealCircuit(qc, options["method"]), bits)
+        result = self.idealSimulator().run(stripped, shots=1, **options).result()
+        distribution = np.asarray(result.data(0)["probabilities"])
+        return float(distribution[answer]), distribution
+
+    def densityMatrixSimulator(self, qc, noise="noisy", prob_1=0.00001, prob_2=0.0001):
+        """
+        :param qc: The circuit to be run
+        :param noise: "noisy" for the noise of the generic backend of qc or "lessNoisy" for gate noise only
+        :param prob_1: The depolarizing error probability of single qubit gates for "lessNoisy"
+        :param prob_2: The depolarizing error probability of cx gates for "lessNoisy"
+        :return: The shared density matrix AerSimulator with the same noise model as runNoisy or runLessNoisy
+        """
+        if noise == "noisy":
+            backend = self.backend(qc)
+            key = (noise, id(backend))
+            if key not in self._densitySimulators:
+                noise_model = NoiseModel.from_backend(backend)
+                self._densitySimulators[key] = AerSimulator(method="density_matrix", noise_model=noise_model)
+        elif noise == "lessNoisy":
+            key = (noise, prob_1, prob_2)
+            if key not in self._densitySimulators:
+                noise_model = self.noiseSimulator(prob_1, prob_2).options.noise_model
+                self._densitySimulators[key] = AerSimulator(method="density_matrix", noise_model=noise_model)
+        else:
+            raise ValueError("noise must be 'noisy' or 'lessNoisy', not {!r}".format(noise))
+        return self._densitySimulators[key]
+
+    def exactNoisySuccessProbability(self, qc, answer, bits, noise="noisy", prob_1=0.00001, prob_2=0.0001):
+        """
+        Computes the exact output distribution of a noisy run with a density matrix instead of sampling shots. The
+        circuit is transpiled as in runNoisy and runLessNoisy, its final measurements are replaced by saving the
+        probabilities of the measured qubits and the readout error of the backend ("noisy" only) is applied to the
+        distribution afterwards.
+        :param qc: The pre-created quantum circuit to be run
+        :param answer: The expected answer for the multiplication
+        :param bits: how many bits there will be in the output, the clbits 0 to bits - 1
+        :param noise: "noisy" for the noise of the generic backend or "lessNoisy" for gate noise only
+        :param prob_1: The depolarizing error probability of single qubit gates for "lessNoisy"
+        :param prob_2: The depolarizing error probability of cx gates for "lessNoisy"
+        :return: The probability of measuring the answer and a NumPy array of the probability of every output value
+        :raises MemoryError: When the density matrix does not fit in the memory limit
+        """
+        memoryLimit = availableMemory() if self.memoryLimit is None else self.memoryLimit
+        if 16 * 4 ** qc.num_qubits > memoryLimit:
+            raise MemoryError("A density matrix of {} qubits needs {:.3g} GB but the limit is {:.3g} GB".format(
+                qc.num_qubits, 16 * 4 ** qc.num_qubits / 1e9, memoryLimit / 1e9))
+        backend = self.backend(qc)
+        stripped, qubits = saveFinalProbabilities(self.transpile(qc, backend), bits)
+        sim = self.densityMatrixSimulator(qc, noise, prob_1, prob_2)
+        result = sim.run(stripped, shots=1).result()
+        distribution = np.asarray(result.data(0)["probabilities"])
+
+        if noise == "noisy":
+            # Each measured qubit flips with the measure error of the backend, as in NoiseModel.from_backend
+            distribution = distribution.reshape((2,) * bits)
+            for i, qubit in enumerate(qubits):
+                properties = backend.target["measure"][(stripped.find_bit(qubit).index,)]
+                error = properties.error if properties is not None and properties.error is not None else 0
+                readout = np.array([[1 - error, error], [error, 1 - error]])
+                distribution = np.moveaxis(np.tensordot(readout, distribution, axes=([0], [bits - 1 - i])), 0,
+                                           bits - 1 - i)
+            distribution = distribution.reshape(-1)
+        return float(distribution[answer]), distribution
+
+    def noisySuccessProbability(self, qc, answer, bits, noise="noisy", shots=1024):
+        """
+        Returns the probability of measuring the answer in a noisy run. Circuits of at most densityMatrixQubits qubits
+        get the exact probability from exactNoisySuccessProbability, larger ones the fraction of shots of one sampled
+        run.
+        :param qc: The pre-created quantum circuit to be run
+        :param answer: The expected answer for the multiplication
+        :param bits: how many bits there will be in the output
+        :param noise: "noisy" for the noise of the generic backend or "lessNoisy" for gate noise only
+        :param shots: The number of shots of a sampled run
+        :return: The probability of measuring the answer
+        """
+        if qc.num_qubits <= self.densityMatrixQubits:
+            return self.exactNoisySuccessProbability(qc, answer, bits, noise)[0]
+        return self.runBatch([(qc, answer, bits, 1)], noise, shots)[0][0] / shots
+
+    def noiseSweep(self, qc, answer, bits, configs, shots=1024):
+        """
+        Computes the success probability of one circuit under every noise configuration in one Aer job. The circuit is
+        transpiled once (or taken from the transpile cache) and each configuration inserts its errors into a copy.
+        Circuits of at most densityMatrixQubits qubits get exact probabilities from a density matrix, larger ones the
+        fraction of shots that measured the answer.
+        :param qc: The pre-created quantum circuit to be run
+        :param answer: The expected answer for the multiplication
+        :param bits: how many bits there will be in the output
+        :param configs: A list of NoiseConfig
+        :param shots: The number of shots of every configuration when sampling
+        :return: The success-vs-noise curve, a list of (config, probability of measuring the answer) pairs
+        """
+        if qc.num_qubits > self.densityMatrixQubits:
+            self.options(qc)
+        circuit = self.transpile(qc, self.backend(qc))
+        noisy = [noisyCircuit(circuit, config) for config in configs]
+        if circuit.num_qubits <= self.densityMatrixQubits:
+            if "sweep" not in self._densitySimulators:
+                self._densitySimulators["sweep"] = AerSimulator(method="density_matrix")
+            saved = [saveFinalProbabilities(noisyQc, bits)[0] for noisyQc in noisy]
+            result = self._densitySimulators["sweep"].run(saved, shots=1).result()
+            probabilities = [float(result.data(i)["probabilities"][answer]) for i in range(len(saved))]
+        else:
+            result = self.idealSimulator().run(noisy, shots=shots, **self.options(noisy[0])).result()
+            key = bin(answer).lstrip('0b').zfill(bits)
+            probabilities = [result.get_counts(i).get(key, 0) / shots for i in range(len(noisy))]
+        return list(zip(configs, probabilities))
+
+    def noiseFidelities(self, qc, noise="noisy"):
+        """
+        :param qc: The pre-created quantum circuit to be run
+        :param noise: "noisy" for the noise of the generic backend, "lessNoisy" for the gate noise of runLessNoisy or a
+                      NoiseConfig
+        :return: The fidelities estimateSuccess uses for that noise
+        """
+        if isinstance(noise, NoiseConfig):
+            return configFidelities(noise)
+        if noise == "lessNoisy":
+            return configFidelities(NoiseConfig(0.00001, 0.0001))
+        if noise == "noisy":
+            backend = self.backend(qc)
+            if id(backend) not in self._fidelities:
+                self._fidelities[id(backend)] = backendFidelities(backend)
+            return self._fidelities[id(backend)]
+        raise ValueError("noise must be 'noisy', 'lessNoisy' or a NoiseConfig, not {!r}".format(noise))
+
+    def estimateSuccessProbability(self, qc, bits, noise="noisy"):
+        """
+        Predicts the probability of measuring the right answer under noise from the gates of the transpiled circuit,
+        without simulating it. See estimateSuccess, the scale is the one of the last calibrateEstimator call.
+        :param qc: The pre-created quantum circuit to be run
+        :param bits: how many bits there will be in the output
+        :param noise: "noisy", "lessNoisy" or a NoiseConfig
+        :return: The predicted probability
+        """
+        circuit = self.transpile(qc, self.backend(qc))
+        return estimateSuccess(circuit, self.noiseFidelities(qc, noise), bits, self.estimatorScale)
+
+    def calibrateEstimator(self, items, noise="noisy"):
+        """
+        Fits the scale of estimateSuccessProbability to exact density matrix results, by least squares on
+        log(F^scale) = scale * log(F), and keeps it for later estimates. The circuits should be small enough for
+        densityMatrixQubits.
+        :param items: A list of (circuit, answer, bits) tuples
+        :param noise: "noisy", "lessNoisy" or a NoiseConfig
+        :return: The fitted scale
+        """
+        products = 0.0
+        squares = 0.0
+        for qc, answer, bits in items:
+            circuit = self.transpile(qc, self.backend(qc))
+            logFidelity = np.log(estimateSuccess(circuit, self.noiseFidelities(qc, noise), bits, 1.0) - 2.0 ** -bits)
+            logFidelity -= np.log(1 - 2.0 ** -bits)
+            if isinstance(noise, NoiseConfig):
+                exact = self.noiseSweep(qc, answer, bits, [noise])[0][1]
+            else:
+                exact = self.exactNoisySuccessProbability(qc, answer, bits, noise)[0]
+            if exact <= 2.0 ** -bits or logFidelity == 0:
+                continue
+            products += logFidelity * np.log((exact - 2.0 ** -bits) / (1 - 2.0 ** -bits))
+            squares += logFidelity ** 2
+        if squares > 0:
+            self.estimatorScale = float(products / squares)
+        return self.estimatorScale
+
+    def runBatch(self, items, noise="noisy", shots=1024, parallelExperiments=0, parallelShots=0, prob_1=0.00001,
+                 prob_2=0.0001):
+        """
+        Runs several circuits, each repeated a number of times, in as few Aer jobs as possible. Every circuit that
+        shares a simulator and simulation options goes into one job, which is one job per method for "ideal" and
+        "lessNoisy" and one job per qubit count for "noisy" (each qubit count has its own generic backend and noise
+        model).
+        :param items: A list of (circuit, answer, bits, repetitions) tuples
+        :param noise: "ideal", "noisy" for the generic backend noise or "lessNoisy" for gate noise only
+        :param shots: The number of shots of every repetition
+        :param parallelExperiments: The max_parallel_experiments of the Aer jobs, 0 to use every core
+        :param parallelShots: The max_parallel_shots of the Aer jobs, 0 to use every core
+        :param prob_1: The depolarizing error probability of single qubit gates for "lessNoisy"
+        :param prob_2: The depolarizing error probability of cx gates for "lessNoisy"
+        :return: A list with, for each item, the number of shots that measured the answer in each repetition
+        """
+        jobs = OrderedDict()  # (id of the simulator, options) -> (simulator, options, [(item index, circuit), ...])
+        for index, (qc, answer, bits, repetitions) in enumerate(items):
+            if noise == "ideal":
+                sim = self.idealSimulator()
+                options = self.options(qc)
+                circuit = self.idealCircuit(qc, options["method"])
+            elif noise == "noisy":
+                self.options(qc)
+                sim = self.backend(qc)
+                circuit = self.transpile(qc, sim)
+                options = self.options(circuit)
+            elif noise == "lessNoisy":
+                self.options(qc)
+                sim = self.noiseSimulator(prob_1, prob_2)
+                circuit = self.transpile(qc, self.backend(qc))
+                options = self.options(circuit)
+            else:
+                raise ValueError("noise must be 'ideal', 'noisy' or 'lessNoisy', not {!r}".format(noise))
+            key = (id(sim), tuple(sorted(options.items())))
+            jobs.setdefault(key, (sim, options, []))[2].extend([(index, circuit)] * repetitions)
+
+        successes = [[] for _ in items]
+        for sim, options, experiments in jobs.values():
+            result = sim.run([circuit for _, circuit in experiments], shots=shots, max_parallel_experiments=
+                             parallelExperiments, max_parallel_shots=parallelShots, **options).result()
+            for position, (index, _) in enumerate(experiments):
+                qc, answer, bits, repetitions = items[index]
+                key = bin(answer).lstrip('0b').zfill(bits)
+                successes[index].append(result.get_counts(position).get(key, 0))
+        return successes
+
+
+# The session behind the module level run functions
+defaultSession = SimulationSession()
+
+
+def runIdeal(qc, answer, bits, printAll=False):
+    """
+    Runs the provided circuit with 1024 shots without noise, using the default SimulationSession
     :param qc: The pre-created quantum circuit to be run
     :param answer: The expected answer for the multiplication
     :param bits: how many bits there will be in the output
     :param printAll: Whether to print all the counts or just those for the answer
     :return: The results of the simulation
     """
-    # Creating a generic backend for the current number of qubits being simulated
-    backend = GenericBackendV2(num_qubits=qc.num_qubits)
-    transpiled_circuit = transpile(qc, backend)
+    return defaultSession.runIdeal(qc, answer, bits, printAll)
 
-    # Perform noisy simulation (Use GPU line if Aer is installed with GPU support) (blocking_qubits=??)
-    result_noise = backend.run(transpiled_circuit).result()
-    # result_noise = backend.run(transpiled_circuit, device="GPU", blocking_enable=True).result()
 
-    counts_noise = result_noise.get_counts(0)
-    if printAll:
-        print('Counts(noise):', counts_noise)
-    key = bin(answer).lstrip('0b').zfill(bits)
-    if key in counts_noise:
-        print(key, ": ", counts_noise[key])
-    else:
-        print("key, ", key, ", not present in results")
-    return result_noise
+def runNoisy(qc, answer, bits, printAll=False):
+    """
+    Runs the provided circuit with 1024 shots and noise, using the default SimulationSession
+    :param qc: The pre-created quantum circuit to be run
+    :param answer: The expected answer for the multiplication
+    :param bits: how many bits there will be in the output
+    :param printAll: Whether to print all the counts or just those for the answer
+    :return: The results of the simulation
+    """
+    return defaultSession.runNoisy(qc, answer, bits, printAll)
 
 
 def runLessNoisy(qc, answer, bits, printAll=False):
     """
-    Runs the provided circuit with 1024 shots and less noise than the previous noise run
+    Runs the provided circuit with 1024 shots and less noise than the previous noise run, using the default
+    SimulationSession
     :param qc: The pre-created quantum circuit to be run
     :param answer: The expected answer for the multiplication
     :param bits: how many bits there will be in the output
     :param printAll: Whether to print all the counts or just those for the answer
     :return: The results of the simulation
     """
-    # Creating a generic backend for the current number of qubits being simulated
-    backend = GenericBackendV2(num_qubits=qc.num_qubits)
+    return defaultSession.runLessNoisy(qc, answer, bits, printAll)
 
-    # Build a noise model that only includes gate noise ie) no decoherence or readout noise
-    noise_model = NoiseModel()
-    prob_1 = 0.00001
-    prob_2 = 0.0001
 
-    error_1 = noise.depolarizing_error(prob_1, 1)
-    error_2 = noise.depolarizing_error(prob_2, 2)
-    noise_model.add_all_qubit_quantum_error(error_1, ['rz', 'sx', 'x'])
-    noise_model.add_all_qubit_quantum_error(error_2, ['cx'])
+def exactSuccessProbability(qc, answer, bits):
+    """
+    Computes the exact output distribution of an ideal run with the default SimulationSession
+    :param qc: The pre-created quantum circuit to be run
+    :param answer: The expected answer for the multiplication
+    :param bits: how many bits there will be in the output
+    :return: The probability of measuring the answer and a NumPy array of the probability of every output value
+    """
+    return defaultSession.exactSuccessProbability(qc, answer, bits)
 
-    sim = AerSimulator(noise_model=noise_model)
 
-    # Perform noisy simulation (Use GPU line if Aer is installed with GPU support) (blocking_qubits=??)
-    transpiled_circuit = transpile(qc, backend)
-    result = sim.run(transpiled_circuit).result()
-    # result = sim.run(transpiled_circuit, device="GPU", blocking_enable=True).result()
-    counts_noise = result.get_counts(0)
+def noisySuccessProbability(qc, answer, bits, noise="noisy"):
+    """
+    Returns the probability of measuring the answer in a noisy run with the default SimulationSession, exactly for
+    circuits of at most its densityMatrixQubits qubits
+    :param qc: The pre-created quantum circuit to be run
+    :param answer: The expected answer for the multiplication
+    :param bits: how many bits there will be in the output
+    :param noise: "noisy" for the noise of the generic backend or "lessNoisy" for gate noise only
+    :return: The probability of measuring the answer
+    """
+    return defaultSession.noisySuccessProbability(qc, answer, bits, noise)
 
-    if printAll:
-        print('Counts(noise):', counts_noise)
-    key = bin(answer).lstrip('0b').zfill(bits)
-    if key in counts_noise:
-        print(key, ": ", counts_noise[key])
-    else:
-        print("key, ", key, ", not present in results")
-    # return result_noise
-    return result
+
+def noiseSweep(qc, answer, bits, configs, shots=1024):
+    """
+    Computes the success probability of one circuit under every noise configuration in one Aer job using the default
+    SimulationSession
+    :param qc: The pre-created quantum circuit to be run
+    :param answer: The expected answer for the multiplication
+    :param bits: how many bits there will be in the output
+    :param configs: A list of NoiseConfig
+    :param shots: The number of shots of every configuration when sampling
+    :return: The success-vs-noise curve, a list of (config, probability of measuring the answer) pairs
+    """
+    return defaultSession.noiseSweep(qc, answer, bits, configs, shots)
+
+
+def runBatch(items, noise="noisy", shots=1024):
+    """
+    Runs several circuits, each repeated a number of times, in as few Aer jobs as possible using the default
+    SimulationSession
+    :param items: A list of (circuit, answer, bits, repetitions) tuples
+    :param noise: "ideal", "noisy" for the generic backend noise or "lessNoisy" for gate noise only
+    :param shots: The number of shots of every repetition
+    :return: A list with, for each item, the number of shots that measured the answer in each repetition
+    """
+    return defaultSession.runBatch(items, noise, shots)
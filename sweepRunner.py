@@ -0,0 +1,292 @@
+from math import ceil, log2
+from multiprocessing import Pipe, Process
+from multiprocessing.connection import wait
+import os
+import random
+import time
+
+from sharedFunctions import SimulationSession
+from resultsStore import ResultsStore
+from resourceModel import QAMResources, OPBResources, IOPBResources, AOPBResources
+import QArrayMultiplier as QAM
+import approxQArrayMultiplier as AQAM
+import RepeatedAddition as OPB
+import ImpRepAddition as IOPB
+import approxRepeatedAddition as AOPB
+import QFourierMultiplier as QFM
+
+
+def defaultLimit(multiplier, multiplicand):
+    """
+    :return: The AQAM phase limit used throughout the tests, ceil(log_2(size_of_product)+2)
+    """
+    return ceil(log2(len(multiplier) + len(multiplicand)) + 2)
+
+
+# name -> (builder, resource model), both called with (multiplier, multiplicand, limit). The QFM has no model of
+# its own, it has the registers and the QFT / controlled phase / inverse QFT shape of the QAM so that one stands in.
+ALGORITHMS = {
+    "OPB": (lambda a, b, limit: OPB.createOPBCircuit(a, b), lambda a, b, limit: OPBResources(a, b)),
+    "IOPB": (lambda a, b, limit: IOPB.createIOPBCircuit(a, b), lambda a, b, limit: IOPBResources(a, b)),
+    "AOPB": (lambda a, b, limit: AOPB.createAOPBCircuit(a, b), lambda a, b, limit: AOPBResources(a, b)),
+    "QFM": (lambda a, b, limit: QFM.createQFMCircuit(a, b), lambda a, b, limit: QAMResources(a, b, depth=False)),
+    "QAM": (lambda a, b, limit: QAM.createQAMCircuit(a, b), lambda a, b, limit: QAMResources(a, b, depth=False)),
+    "AQAM": (lambda a, b, limit: AQAM.createAQAMCircuit(a, b, limit),
+             lambda a, b, limit: QAMResources(a, b, limit, depth=False)),
+}
+# The algorithms compared by FunctionalTests
+COMPARED = ("OPB", "IOPB", "QFM", "QAM", "AQAM")
+
+
+# ----------------------Grid---------------------------
+def operands(pattern, size, seed=None):
+    """
+    :param pattern: "square" for size ones times size ones, "identity" for size ones times "1" or "random" for two
+                    random size bit numbers with their top bit set
+    :param size: The number of bits of the operands
+    :param seed: The seed of the "random" operands, the same seed and size always give the same operands
+    :return: The (multiplier, multiplicand) binary strings
+    """
+    if pattern == "square":
+        return "1" * size, "1" * size
+    if pattern == "identity":
+        return "1" * size, "1"
+    if pattern == "random":
+        rng = random.Random("{}:{}".format(seed, size))
+        return tuple("1" + "".join(rng.choice("01") for _ in range(size - 1)) for _ in range(2))
+    raise ValueError("pattern must be 'square', 'identity' or 'random', not {!r}".format(pattern))
+
+
+def expandGrid(algorithms=COMPARED, patterns=("square", "identity"), sizes=range(1, 5), limits=(None,),
+               noises=("noisy", "lessNoisy"), repetitions=1, seed=None):
+    """
+    Expands a grid of sweep parameters into one task per point. Limits only apply to the AQAM, where None is the
+    default limit, and the QFM is only built for operands of equal length.
+    :param algorithms: Names from ALGORITHMS
+    :param patterns: Operand patterns, see operands
+    :param sizes: Operand sizes in bits
+    :param limits: AQAM phase limits
+    :param noises: "ideal", "noisy" or "lessNoisy", see SimulationSession.runBatch
+    :param repetitions: The number of times each circuit is run
+    :param seed: The seed of the "random" operands, the generated backend and the transpiler
+    :return: A list of task dicts
+    """
+    tasks = []
+    seen = set()
+    for algorithm in algorithms:
+        if algorithm not in ALGORITHMS:
+            raise ValueError("Unknown algorithm {!r}".format(algorithm))
+        for pattern in patterns:
+            for size in sizes:
+                multiplier, multiplicand = operands(pattern, size, seed)
+                if algorithm == "QFM" and len(multiplier) != len(multiplicand):
+                    continue
+                for limit in (limits if algorithm == "AQAM" else (None,)):
+                    if algorithm == "AQAM" and limit is None:
+                        limit = defaultLimit(multiplier, multiplicand)
+                    if (algorithm, pattern, size, limit) in seen:
+                        continue  # an explicit limit equal to the default one
+                    seen.add((algorithm, pattern, size, limit))
+                    for noise in noises:
+                        tasks.append({"algorithm": algorithm, "pattern": pattern, "size": size,
+                                      "multiplier": multiplier, "multiplicand": multiplicand, "limit": limit,
+                                      "noise": noise, "backend": "GenericBackendV2", "seed": seed,
+                                      "repetitions": repetitions})
+    return tasks
+
+
+def taskCost(task):
+    """
+    Estimates the simulation time of a task as gates * 2^qubits * repetitions, using the resource models so no
+    circuit is built. Only the order of the costs matters.
+    :param task: A task dict from expandGrid
+    :return: The estimated cost
+    """
+    multiplier, multiplicand = task["multiplier"], task["multiplicand"]
+    gates = ALGORITHMS[task["algorithm"]][1](multiplier, multiplicand, task["limit"])["gates"]
+    qubits = 2 * (len(multiplier) + len(multiplicand))
+    return gates * 2 ** qubits * task["repetitions"]
+
+
+# ----------------------Running---------------------------
+_sessions = {}  # seed -> SimulationSession of this process
+
+
+def taskSession(task):
+    """
+    :param task: A task dict from expandGrid
+    :return: The SimulationSession of this process for the seed of the task
+    """
+    if task["backend"] != "GenericBackendV2":
+        raise ValueError("Unknown backend {!r}".format(task["backend"]))
+    seed = task.get("seed")
+    if seed not in _sessions:
+        _sessions[seed] = SimulationSession(seed=seed, seed_transpiler=seed)
+    return _sessions[seed]
+
+
+def runTask(task, shots=1024, minSuccess=None, estimatorScale=1.0):
+    """
+    Builds, transpiles and runs one task in the current process. Tasks run single threaded since the pool already uses
+    every core.
+    :param task: A task dict from expandGrid
+    :param shots: The number of shots of every repetition
+    :param minSuccess: The predicted success probability below which a noisy task is not simulated, or None
+    :param estimatorScale: The scale of the success estimator, see SimulationSession.calibrateEstimator
+    :return: The task dict extended with the status, the qubits, depth, gates and cx of the transpiled circuit, the
+             predicted success probability, the build, transpile and simulate times, the success counts, shots and
+             elapsed time. Tasks predicted below minSuccess have the status "pruned" and no success counts.
+    """
+    start = time.perf_counter()
+    session = taskSession(task)
+    session.estimatorScale = estimatorScale
+    multiplier, multiplicand = task["multiplier"], task["multiplicand"]
+    qc = ALGORITHMS[task["algorithm"]][0](multiplier, multiplicand, task["limit"])
+    built = time.perf_counter()
+    transpiled = session.transpile(qc, session.backend(qc))  # runBatch reuses it from the session cache
+    ops = transpiled.count_ops()
+    transpileEnd = time.perf_counter()
+    answer = int(multiplier, 2) * int(multiplicand, 2)
+    bits = len(multiplier) + len(multiplicand)
+    record = dict(task, status="ok", qubits=qc.num_qubits, depth=transpiled.depth(),
+                  gates=sum(ops.values()) - ops.get("measure", 0) - ops.get("barrier", 0), cx=ops.get("cx", 0),
+                  predicted=None, buildTime=built - start, transpileTime=transpileEnd - built, shots=shots)
+    if task["noise"] != "ideal":
+        record["predicted"] = session.estimateSuccessProbability(qc, bits, task["noise"])
+        if minSuccess is not None and record["predicted"] < minSuccess:
+            record.update(status="pruned", successes=None, simulateTime=0.0, elapsed=time.perf_counter() - start)
+            return record
+
+    simulateStart = time.perf_counter()
+    record["successes"] = session.runBatch([(qc, answer, bits, task["repetitions"])], task["noise"], shots,
+                                           parallelExperiments=1, parallelShots=1)[0]
+    end = time.perf_counter()
+    record.update(simulateTime=end - simulateStart, elapsed=end - start)
+    return record
+
+
+def calibrateScale(noise="noisy", sizes=range(1, 3), seed=None):
+    """
+    Fits the success estimator to exact density matrix results of every compared algorithm on small square and
+    identity inputs
+    :param noise: "noisy" or "lessNoisy"
+    :param sizes: Operand sizes small enough for a density matrix
+    :param seed: The seed of the generated backend and the transpiler, the same as the sweep it is used for
+    :return: The scale to pass to runSweep
+    """
+    items = []
+    for task in expandGrid(COMPARED, ("square", "identity"), sizes, noises=(noise,), seed=seed):
+        multiplier, multiplicand = task["multiplier"], task["multiplicand"]
+        qc = ALGORITHMS[task["algorithm"]][0](multiplier, multiplicand, task["limit"])
+        items.append((qc, int(multiplier, 2) * int(multiplicand, 2), len(multiplier) + len(multiplicand)))
+    return taskSession(task).calibrateEstimator(items, noise)
+
+
+def _worker(task, shots, minSuccess, estimatorScale, connection):
+    try:
+        record = runTask(task, shots, minSuccess, estimatorScale)
+    except Exception as error:
+        record = dict(task, status="error", error=repr(error))
+    connection.send(record)
+    connection.close()
+
+
+def runSweep(tasks, processes=None, timeout=None, shots=1024, onResult=None, store=None, minSuccess=None,
+             estimatorScale=1.0):
+    """
+    Runs tasks across a pool of worker processes, starting the most expensive tasks first so the long ones do not end
+    up running alone at the end of the sweep. Every task gets its own process, which is killed once it runs longer
+    than the timeout.
+    :param tasks: A list of task dicts from expandGrid
+    :param processes: The number of tasks run at once, the number of cores when None
+    :param timeout: The number of seconds a task may run, or None for no limit
+    :param shots: The number of shots of every repetition
+    :param onResult: A function called with every finished record as soon as it is available
+    :param store: A ResultsStore, or the path of one, that every record is added to. Tasks it already holds are skipped
+                  so an interrupted sweep resumes where it stopped
+    :param minSuccess: The predicted success probability below which noisy tasks are recorded as "pruned" instead of
+                       simulated, or None to simulate everything
+    :param estimatorScale: The scale of the success estimator, see SimulationSession.calibrateEstimator
+    :return: The list of records in the order they finished, see runTask. Failed tasks have the status "error" or
+             "timeout" and skipped ones "pruned" instead of "ok"
+    """
+    if isinstance(store, str):
+        store = ResultsStore(store)
+    if store is not None:
+        tasks = store.pending(tasks)
+    processes = processes or os.cpu_count()
+    pending = sorted(tasks, key=taskCost)  # cheapest first, popped from the end
+    running = {}  # connection -> (process, task, deadline)
+    results = []
+
+    def finish(record):
+        results.append(record)
+        if store is not None:
+            store.add(record)
+        if onResult is not None:
+            onResult(record)
+
+    while pending or running:
+        while pending and len(running) < processes:
+            task = pending.pop()
+            receiver, sender = Pipe(duplex=False)
+            process = Process(target=_worker, args=(task, shots, minSuccess, estimatorScale, sender), daemon=True)
+            process.start()
+            sender.close()
+            running[receiver] = (process, task, None if timeout is None else time.monotonic() + timeout)
+
+        deadlines = [deadline for _, _, deadline in running.values() if deadline is not None]
+        waitTime = max(0, min(deadlines) - time.monotonic()) if deadlines else None
+        for receiver in wait(list(running), waitTime):
+            process, task, _ = running.pop(receiver)
+            try:
+                record = receiver.recv()
+            except EOFError:
+                record = dict(task, status="error", error="worker exited with code {}".format(process.exitcode))
+            receiver.close()
+            process.join()
+            finish(record)
+
+        now = time.monotonic()
+        for receiver, (process, task, deadline) in list(running.items()):
+            if deadline is not None and now >= deadline:
+                process.kill()
+                process.join()
+                receiver.close()
+                del running[receiver]
+                finish(dict(task, status="timeout", error="ran longer than {}s".format(timeout)))
+    return results
+
+
+def printSweep(results):
+    """
+    Prints one line per record, sorted by algorithm, pattern, size and noise
+
+    :param results: The records returned by runSweep
+    :return: N/A
+    """
+    print("____________________________________")
+    for record in sorted(results, key=lambda r: (r["algorithm"], r["pattern"], r["size"], str(r["limit"]),
+                                                   r["noise"])):
+        name = "{} {} {} x {}".format(record["algorithm"], record["noise"], record["multiplier"],
+                                      record["multiplicand"])
+        if record["limit"] is not None:
+            name += " (limit {})".format(record["limit"])
+        if record["status"] == "pruned":
+            print(name, ": ", "pruned, predicted {:.4f}".format(record["predicted"]))
+        elif record["status"] == "ok":
+            print(name, ": ", record["successes"], " of ", record["shots"], " in {:.2f}s".format(record["elapsed"]))
+        else:
+            print(name, ": ", record["status"], record["error"])
+    print("____________________________________")
+
+
+def main():
+    tasks = expandGrid(COMPARED, ("square", "identity"), range(1, 4), noises=("noisy",), repetitions=5, seed=0)
+    scale = calibrateScale("noisy", seed=0)
+    runSweep(tasks, timeout=600, store="sweep.jsonl", minSuccess=0.05, estimatorScale=scale)
+    printSweep([record for record in ResultsStore("sweep.jsonl").records() if record["status"] == "ok"])
+
+
+if __name__ == "__main__":
+    main()